@@ -5,14 +5,23 @@ import gdata
 import gdata.service
 import douban
 import urllib
+import threading
+import time
+import Queue
 import oauth, client
 
 class DoubanService(gdata.service.GDataService):
     def __init__(self, api_key=None, secret=None,
             source='douban-python', server='api.douban.com', 
-            additional_headers=None):
+            additional_headers=None, min_interval=0):
         self.api_key = api_key
         self.client = client.OAuthClient(key=api_key, secret=secret)
+        # Minimum seconds between the starts of two batched requests
+        self.min_interval = min_interval
+        self._last_request = 0
+        self._throttle_lock = threading.Lock()
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
         gdata.service.GDataService.__init__(self, service='douban', source=source,
                 server=server, additional_headers=additional_headers)
 
@@ -60,6 +69,125 @@ class DoubanService(gdata.service.GDataService):
     def GetPeopleFeed(self, uri):
         return self.Get(uri, converter=douban.PeopleFeedFromString)
 
+    def GetPeopleBatch(self, uids, max_workers=4):
+        """Fetch many people entries at once, see GetBatch."""
+        return self.GetBatch(['/people/%s' % uid for uid in uids],
+                douban.PeopleEntryFromString, max_workers=max_workers)
+
+    def GetBatch(self, uris, converter, max_workers=4):
+        """Fetch uris concurrently, spaced out by min_interval.
+
+        Returns a list of (result, error) pairs in the order of uris,
+        exactly one of which is None. Duplicate uris, within this batch
+        or already in flight from another thread, share one request.
+
+        """
+        unique = []
+        index = {}
+        for uri in uris:
+            if uri not in index:
+                index[uri] = len(unique)
+                unique.append(uri)
+        results = [None] * len(unique)
+        pending = Queue.Queue()
+        for i in range(len(unique)):
+            pending.put(i)
+
+        def worker():
+            while True:
+                try:
+                    i = pending.get_nowait()
+                except Queue.Empty:
+                    return
+                call = self._CoalescedGet(unique[i], converter)
+                results[i] = (call.result, call.error)
+
+        threads = [threading.Thread(target=worker)
+                   for n in range(min(max_workers, len(unique)))]
+        for t in threads:
+            t.setDaemon(True)
+            t.start()
+        for t in threads:
+            t.join()
+        return [results[index[uri]] for uri in uris]
+
+    def IterFeed(self, uri, converter, start_index=1, max_results=50):
+        """Yield the entries of a paged feed across all of its pages.
+
+        The next page is fetched in the background while the entries of
+        the current one are consumed. Paging stops at totalResults, or
+        at the first short page if the feed does not report it.
+
+        """
+        def fetch(start):
+            self._Throttle()
+            query = Query(uri, start_index=start, max_results=max_results)
+            return self.Get(query.ToUri(), {}, converter=converter)
+
+        start = start_index
+        page = self._Prefetch(fetch, start)
+        while page is not None:
+            page.done.wait()
+            if page.error is not None:
+                raise page.error
+            feed = page.result
+            start += max_results
+            page = None
+            if feed.entry and _HasMorePages(feed, start, max_results):
+                page = self._Prefetch(fetch, start)
+            for entry in feed.entry:
+                yield entry
+
+    def _Prefetch(self, fetch, start):
+        call = _Call()
+        def run():
+            try:
+                call.result = fetch(start)
+            except Exception, e:
+                call.error = e
+            call.done.set()
+        t = threading.Thread(target=run)
+        t.setDaemon(True)
+        t.start()
+        return call
+
+    def _Throttle(self):
+        self._throttle_lock.acquire()
+        try:
+            wait = self._last_request + self.min_interval - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            self._last_request = time.time()
+        finally:
+            self._throttle_lock.release()
+
+    def _CoalescedGet(self, uri, converter):
+        key = (uri, converter)
+        self._inflight_lock.acquire()
+        try:
+            call = self._inflight.get(key)
+            owner = call is None
+            if owner:
+                call = self._inflight[key] = _Call()
+        finally:
+            self._inflight_lock.release()
+
+        if not owner:
+            call.done.wait()
+            return call
+        try:
+            self._Throttle()
+            call.result = self.Get(uri, {}, converter=converter)
+        except Exception, e:
+            call.error = e
+        self._inflight_lock.acquire()
+        try:
+            del self._inflight[key]
+        finally:
+            self._inflight_lock.release()
+        call.done.set()
+        return call
+
     def SearchPeople(self, text_query, start_index=None, max_results=None):
         query = Query('/people/', text_query, start_index=start_index,
                 max_results=max_results)
@@ -381,6 +509,20 @@ class DoubanService(gdata.service.GDataService):
         return self.Delete(entry.id.text)
 
 
+class _Call(object):
+    """A request in flight, shared by everyone waiting for its uri."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _HasMorePages(feed, next_start, max_results):
+    if feed.total_results is not None and feed.total_results.text:
+        return next_start <= int(feed.total_results.text)
+    return len(feed.entry) >= max_results
+
+
 class Query(gdata.service.Query):
     def __init__(self, feed=None, text_query=None, start_index=None,
             max_results=None, **params):
@@ -0,0 +1,65 @@
+# encoding: UTF-8
+
+import threading
+import time
+import douban
+import douban.service
+from gdata.service import RequestError
+import testdata
+
+class FakeService(douban.service.DoubanService):
+    """Answers every GET with the test people entry, without network."""
+    def __init__(self, delay=0, **kwargs):
+        douban.service.DoubanService.__init__(self, **kwargs)
+        self.delay = delay
+        self.requested = []
+
+    def Get(self, uri, extra_headers={}, converter=None):
+        self.requested.append(uri)
+        time.sleep(self.delay)
+        if uri.endswith('/banned'):
+            raise RequestError({'status': 403, 'reason': 'Forbidden',
+                                'body': ''})
+        return converter(testdata.TEST_PEOPLE_ENTRY)
+
+def test_batch_keeps_input_order():
+    service = FakeService()
+    uris = ['/people/%d' % i for i in range(10)]
+    results = service.GetBatch(uris, lambda x: x)
+    assert len(results) == 10
+    assert all(error is None for result, error in results)
+    assert sorted(service.requested) == sorted(uris)
+
+def test_batch_collapses_duplicates():
+    service = FakeService()
+    results = service.GetPeopleBatch([1, 2, 1, 1, 2])
+    assert len(results) == 5
+    assert sorted(service.requested) == ['/people/1', '/people/2']
+    assert results[0][0] is results[2][0]
+    assert results[0][0].location.text == "北京"
+
+def test_batch_reports_errors_per_item():
+    service = FakeService()
+    results = service.GetPeopleBatch(['1', 'banned', '2'])
+    assert results[0][1] is None and results[2][1] is None
+    assert results[1][0] is None
+    assert isinstance(results[1][1], RequestError)
+
+def test_concurrent_callers_share_request():
+    service = FakeService(delay=0.2)
+    results = []
+    def caller():
+        results.append(service.GetPeopleBatch([1000001]))
+    threads = [threading.Thread(target=caller) for i in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert service.requested == ['/people/1000001']
+    assert len(results) == 3
+
+def test_batch_respects_min_interval():
+    service = FakeService(min_interval=0.05)
+    begin = time.time()
+    service.GetBatch(['/people/%d' % i for i in range(5)], lambda x: x)
+    assert time.time() - begin >= 0.2
@@ -0,0 +1,66 @@
+# encoding: UTF-8
+
+import cgi
+import douban
+import douban.service
+
+FEED = """<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom" xmlns:opensearch="http://a9.com/-/spec/opensearchrss/1.0/">
+    <title>paging</title>
+    %s
+    %s
+</feed>"""
+
+class PagedService(douban.service.DoubanService):
+    """Serves a feed of `total' numbered people, without network."""
+    def __init__(self, total, report_total=True, **kwargs):
+        douban.service.DoubanService.__init__(self, **kwargs)
+        self.total = total
+        self.report_total = report_total
+        self.requested = []
+
+    def Get(self, uri, extra_headers={}, converter=None):
+        self.requested.append(uri)
+        params = cgi.parse_qs(uri.split('?', 1)[1])
+        start = int(params['start-index'][0])
+        count = int(params['max-results'][0])
+        entries = ''.join(['<entry><title>%d</title></entry>' % i
+                           for i in range(start, min(start + count,
+                                                     self.total + 1))])
+        total = ''
+        if self.report_total:
+            total = '<opensearch:totalResults>%d</opensearch:totalResults>' \
+                    % self.total
+        return converter(FEED % (total, entries))
+
+def titles(entries):
+    return [int(e.title.text) for e in entries]
+
+def test_iter_feed_walks_all_pages():
+    service = PagedService(23)
+    entries = service.IterFeed('/people/1/contacts',
+                               douban.PeopleFeedFromString, max_results=10)
+    assert titles(entries) == range(1, 24)
+    assert len(service.requested) == 3
+
+def test_iter_feed_stops_on_total_results():
+    service = PagedService(20)
+    entries = service.IterFeed('/people/1/contacts',
+                               douban.PeopleFeedFromString, max_results=10)
+    assert titles(entries) == range(1, 21)
+    assert len(service.requested) == 2
+
+def test_iter_feed_without_total_results():
+    service = PagedService(20, report_total=False)
+    entries = service.IterFeed('/people/1/friends',
+                               douban.PeopleFeedFromString, max_results=10)
+    assert titles(entries) == range(1, 21)
+    assert len(service.requested) == 3
+
+def test_iter_feed_is_lazy():
+    service = PagedService(100)
+    entries = service.IterFeed('/people/1/friends',
+                               douban.PeopleFeedFromString, max_results=10)
+    assert service.requested == []
+    entries.next()
+    assert len(service.requested) <= 2
@@ -0,0 +1,117 @@
+#
+# Append-only archive of raw API responses
+# author: Wu Zhe <wu@madk.org>
+#
+# The archive is a directory of gzipped segments, segment-000001.gz and
+# up, each holding records of
+#
+#     FETCHED \t URI \t STATUS \t LENGTH \n TEXT \n
+#
+# where FETCHED is the UTC time in sqlite's DATETIME format and TEXT the
+# LENGTH bytes of the response body, empty for a 404. Segments are only
+# ever appended to, a new one is started once SEGMENT_SIZE bytes went
+# into the current one or when the archive is opened again.
+#
+
+import os, re, time, gzip, zlib, struct, threading
+
+ARCHIVE_PATH = os.path.normpath('../archive')
+SEGMENT_SIZE = 64 * 1024 * 1024 # uncompressed bytes per segment
+
+SEGMENT_RE = re.compile(r'^segment-(\d+)\.gz$')
+
+def segments(path):
+    """Paths of the segments in the archive at path, oldest first."""
+    if not os.path.isdir(path):
+        return []
+    numbered = []
+    for name in os.listdir(path):
+        m = SEGMENT_RE.match(name)
+        if m:
+            numbered.append((int(m.group(1)), os.path.join(path, name)))
+    numbered.sort()
+    return [p for n, p in numbered]
+
+def read_segment(path):
+    """The (fetched, uri, status, text) records in a segment.
+
+    A segment the crawler was killed while writing ends in a partial
+    record or lacks the gzip trailer, it is read up to the last record
+    flushed.
+    """
+    f = gzip.GzipFile(path, 'rb')
+    try:
+        while True:
+            try:
+                header = f.readline()
+                if not header.endswith('\n'):
+                    break
+                fetched, uri, status, length = header[:-1].split('\t')
+                text = f.read(int(length) + 1)
+                if len(text) != int(length) + 1:
+                    break
+            except (IOError, EOFError, struct.error, zlib.error):
+                break
+            yield fetched, uri, int(status), text[:-1]
+    finally:
+        f.close()
+
+class Archive:
+    """Appends responses to the archive at path, safe to share between
+    threads. flush() makes what was appended so far survive a crash.
+    """
+
+    def __init__(self, path=ARCHIVE_PATH, segment_size=SEGMENT_SIZE):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.segment_size = segment_size
+        self.lock = threading.Lock()
+        existing = segments(path)
+        self.number = 0
+        if existing:
+            name = os.path.basename(existing[-1])
+            self.number = int(SEGMENT_RE.match(name).group(1))
+        self.segment = None
+        self.written = 0
+
+    def _next_segment(self):
+        if self.segment is not None:
+            self.segment.close()
+        self.number += 1
+        self.segment = gzip.GzipFile(os.path.join(
+            self.path, 'segment-%06d.gz' % self.number), 'wb')
+        self.written = 0
+
+    def append(self, uri, status, text=''):
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        fetched = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+        record = '%s\t%s\t%d\t%d\n%s\n' % (fetched, uri, status, len(text),
+                                           text)
+        self.lock.acquire()
+        try:
+            if self.segment is None or self.written >= self.segment_size:
+                self._next_segment()
+            self.segment.write(record)
+            self.written += len(record)
+        finally:
+            self.lock.release()
+
+    def flush(self):
+        self.lock.acquire()
+        try:
+            if self.segment is not None:
+                self.segment.flush()
+                os.fsync(self.segment.fileobj.fileno())
+        finally:
+            self.lock.release()
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            if self.segment is not None:
+                self.segment.close()
+                self.segment = None
+        finally:
+            self.lock.release()
@@ -0,0 +1,36 @@
+#
+# A cache of expiring answers
+# author: Wu Zhe <wu@madk.org>
+#
+
+import time, threading
+
+class TTLCache:
+    """Keeps each entry for the `ttl' seconds it was put with. Safe to
+    share between threads."""
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        self.lock.acquire()
+        try:
+            value, expires = self.entries.get(key, (default, 0))
+            if expires > time.time():
+                self.hits += 1
+                return value
+            self.entries.pop(key, None)
+            self.misses += 1
+            return default
+        finally:
+            self.lock.release()
+
+    def put(self, key, value, ttl):
+        self.lock.acquire()
+        try:
+            self.entries[key] = (value, time.time() + ttl)
+        finally:
+            self.lock.release()
@@ -0,0 +1,102 @@
+#
+# Log of the users and edges added to the crawler database
+# author: Wu Zhe <wu@madk.org>
+#
+# Usage: python changelog.py [DB_PATH [trim]]
+#
+# Triggers number every user, friend pair and follow inserted, in the
+# transaction that inserts it, so a change is in the log exactly when
+# its row is in the database. Users are never updated, the first row
+# stored wins, so inserts are all there is to log.
+#
+# A job that wants only what is new since its last run keeps its place
+# in `change_offsets':
+#
+#     since = changelog.offset(conn, 'rank')
+#     for seq, kind, a, b in changelog.read(conn, since):
+#         ...
+#     changelog.save_offset(conn, 'rank', seq)
+#
+# A job without an offset yet reads the whole tables, after taking
+# last() as its offset. Changes every job is past can be trimmed.
+#
+
+import os, sys, sqlite3
+
+DB_PATH = os.path.normpath('../data.db')
+BATCH_SIZE = 10000 # changes read at once
+
+# Kinds of change, as stored. `a' and `b' are the uid of a new user and
+# NULL, the pair of a friends row or that of a follows row.
+USER, FRIENDS, FOLLOWS = 0, 1, 2
+KINDS = {USER: 'users', FRIENDS: 'friends', FOLLOWS: 'follows'}
+
+def last(conn):
+    """The sequence number of the latest change, 0 if none."""
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE "
+                       "name = 'changes'").fetchone()
+    return row and row[0] or 0
+
+def read(conn, since=0, limit=None):
+    """Yield (seq, kind, a, b) of the changes after `since', oldest
+    first, with kind one of 'users', 'friends' and 'follows'.
+
+    Reads BATCH_SIZE changes per query, so a long log is never held in
+    memory and changes committed meanwhile are picked up too.
+    """
+    left = limit
+    while left is None or left > 0:
+        batch = BATCH_SIZE
+        if left is not None:
+            batch = min(batch, left)
+            left -= batch
+        rows = conn.execute("SELECT seq, kind, a, b FROM changes WHERE "
+                            "seq > ? ORDER BY seq LIMIT ?",
+                            (since, batch)).fetchall()
+        for seq, kind, a, b in rows:
+            yield seq, KINDS[kind], a, b
+        if len(rows) < batch:
+            break
+        since = rows[-1][0]
+
+def offset(conn, consumer):
+    """Where `consumer' saved it was up to, None if it never did."""
+    row = conn.execute("SELECT seq FROM change_offsets WHERE consumer = ?",
+                       (consumer,)).fetchone()
+    return row and row[0]
+
+def save_offset(conn, consumer, seq):
+    conn.execute("INSERT OR REPLACE INTO change_offsets VALUES (?, ?)",
+                 (consumer, seq))
+    conn.commit()
+
+def trim(conn, before=None):
+    """Delete the changes up to `before', by default those every
+    consumer is past. Returns the number deleted."""
+    if before is None:
+        before = conn.execute("SELECT min(seq) FROM "
+                              "change_offsets").fetchone()[0]
+        if before is None:
+            return 0
+    cursor = conn.execute("DELETE FROM changes WHERE seq <= ?", (before,))
+    conn.commit()
+    return cursor.rowcount
+
+def main():
+    db_path = len(sys.argv) > 1 and sys.argv[1] or DB_PATH
+    conn = sqlite3.connect(db_path, timeout=60)
+    latest = last(conn)
+    first = conn.execute("SELECT min(seq) FROM changes").fetchone()[0]
+    if first is None:
+        print "no changes kept, the latest was %d" % latest
+    else:
+        print "changes %d to %d" % (first, latest)
+    for consumer, seq in conn.execute("SELECT consumer, seq FROM "
+                                      "change_offsets ORDER BY consumer"):
+        print "  %-20s at %d, %d behind" % (consumer, seq, latest - seq)
+    if len(sys.argv) > 2 and sys.argv[2] == 'trim':
+        print "trimmed %d changes" % trim(conn)
+    conn.close()
+
+if __name__ == "__main__":
+    main()
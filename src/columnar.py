@@ -0,0 +1,310 @@
+#
+# Export users and tastes to column files for analysis
+# author: Wu Zhe <wu@madk.org>
+#
+# Usage: python columnar.py [-o DIR] [-n ROWS] [--degrees] [--tastes] [DB]
+#        python columnar.py --info FILE
+#
+# A column file holds rows in groups of ROW_GROUP, and each group holds
+# its columns one after the other, each deflated on its own:
+#
+#   MAGIC, then per group and column an encoded chunk, then a marshalled
+#   footer, its length as '<Q' and MAGIC again
+#
+# The footer has the columns and their encodings, where each chunk is
+# with the least and greatest value in it, and the dictionaries. So a
+# Reader reads only the chunks of the columns it is asked for, and skips
+# the groups whose least and greatest values rule them out. Integers are
+# native-endian C longs, as array('l') has them; a file is only read
+# where longs are as long as where it was written.
+#
+#   DELTA  differences to the previous value, for sorted columns
+#   PLAIN  values
+#   TEXT   the size of the lengths as '<Q', int32 lengths in bytes, -1
+#          for NULL, then the utf-8 text
+#   DICT   int32 codes into a dictionary kept for the whole file, -1 for
+#          NULL, for columns of few distinct values
+#
+# Integer columns have no NULLs.
+#
+
+import os, sys, sqlite3, struct, array, marshal, zlib, optparse
+import compact
+
+DB_PATH = os.path.normpath('../data.db')
+EXPORT_DIR = os.path.normpath('../columns')
+ROW_GROUP = 65536 # rows per group
+LEVEL = 6 # zlib level
+
+MAGIC = 'DBCOL1'
+SIZE = struct.Struct('<Q') # of the footer, and of lengths in TEXT chunks
+
+DELTA, PLAIN, TEXT, DICT = 'delta', 'plain', 'text', 'dict'
+
+USERS_COLUMNS = [('uid', DELTA), ('uid_text', TEXT), ('location', DICT),
+                 ('nickname', TEXT), ('icon_url', TEXT), ('homepage', TEXT),
+                 ('description', TEXT), ('created', TEXT)]
+DEGREE_COLUMNS = [('friends', PLAIN), ('follows', PLAIN),
+                  ('followers', PLAIN)]
+TASTES_COLUMNS = [('uid', DELTA), ('cat', DICT), ('tag', DICT),
+                  ('count', PLAIN)]
+
+INT_TYPE = 'l' # array type of integer columns
+
+def _utf8(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+class Writer:
+    """Writes rows of `columns', a list of (name, encoding), to path,
+    which appears complete or not at all."""
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = list(columns)
+        self.file = open(path + '.part', 'wb')
+        self.file.write(MAGIC)
+        self.groups = []
+        self.codes = dict([(name, {}) for name, encoding in columns
+                           if encoding == DICT])
+        self.rows = 0
+
+    def _encode(self, name, encoding, values):
+        if encoding == DELTA:
+            deltas = array.array(INT_TYPE, values)
+            for i in xrange(len(deltas) - 1, 0, -1):
+                deltas[i] -= deltas[i - 1]
+            return deltas.tostring()
+        if encoding == PLAIN:
+            return array.array(INT_TYPE, values).tostring()
+        if encoding == DICT:
+            codes = self.codes[name]
+            ids = array.array('i')
+            for value in values:
+                if value is None:
+                    ids.append(-1)
+                else:
+                    ids.append(codes.setdefault(value, len(codes)))
+            return ids.tostring()
+        lengths = array.array('i')
+        texts = []
+        for value in values:
+            if value is None:
+                lengths.append(-1)
+            else:
+                text = _utf8(value)
+                lengths.append(len(text))
+                texts.append(text)
+        lengths = lengths.tostring()
+        return SIZE.pack(len(lengths)) + lengths + ''.join(texts)
+
+    def write_group(self, rows):
+        """Write up to ROW_GROUP rows as one group."""
+        if not rows:
+            return
+        chunks = {}
+        for i, (name, encoding) in enumerate(self.columns):
+            values = [row[i] for row in rows]
+            data = zlib.compress(self._encode(name, encoding, values), LEVEL)
+            present = [value for value in values if value is not None]
+            low = high = None
+            if present:
+                low, high = min(present), max(present)
+            chunks[name] = (self.file.tell(), len(data), low, high)
+            self.file.write(data)
+        self.groups.append({'rows': len(rows), 'chunks': chunks})
+        self.rows += len(rows)
+
+    def close(self):
+        dictionaries = {}
+        for name, codes in self.codes.iteritems():
+            values = [None] * len(codes)
+            for value, code in codes.iteritems():
+                values[code] = value
+            dictionaries[name] = values
+        footer = marshal.dumps({'columns': self.columns,
+                                'groups': self.groups,
+                                'dictionaries': dictionaries,
+                                'int_size': array.array(INT_TYPE).itemsize})
+        self.file.write(footer + SIZE.pack(len(footer)) + MAGIC)
+        self.file.close()
+        os.rename(self.path + '.part', self.path)
+
+class Reader:
+    """Rows of a column file, reading as little of it as it can.
+
+    bytes_read counts the bytes of chunks read so far.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.file.seek(-(SIZE.size + len(MAGIC)), 2)
+        tail = self.file.read()
+        if self.file.tell() < 2 * len(MAGIC) or tail[-len(MAGIC):] != MAGIC:
+            raise ValueError("%s is not a complete column file" % path)
+        size = SIZE.unpack(tail[:SIZE.size])[0]
+        self.file.seek(-(size + len(tail)), 2)
+        footer = marshal.loads(self.file.read(size))
+        if footer['int_size'] != array.array(INT_TYPE).itemsize:
+            raise ValueError("%s has %d byte integers" %
+                             (path, footer['int_size']))
+        self.columns = footer['columns']
+        self.encodings = dict(self.columns)
+        self.groups = footer['groups']
+        self.dictionaries = footer['dictionaries']
+        self.rows = sum([group['rows'] for group in self.groups])
+        self.bytes_read = 0
+
+    def _chunk(self, group, name):
+        offset, length, low, high = group['chunks'][name]
+        self.file.seek(offset)
+        data = zlib.decompress(self.file.read(length))
+        self.bytes_read += length
+        encoding = self.encodings[name]
+        if encoding in (DELTA, PLAIN):
+            values = array.array(INT_TYPE)
+            values.fromstring(data)
+            if encoding == DELTA:
+                for i in xrange(1, len(values)):
+                    values[i] += values[i - 1]
+            return values
+        if encoding == DICT:
+            codes = array.array('i')
+            codes.fromstring(data)
+            dictionary = self.dictionaries[name]
+            return [dictionary[code] if code >= 0 else None for code in codes]
+        size = SIZE.unpack(data[:SIZE.size])[0]
+        lengths = array.array('i')
+        lengths.fromstring(data[SIZE.size:SIZE.size + size])
+        values = []
+        offset = SIZE.size + size
+        for length in lengths:
+            if length < 0:
+                values.append(None)
+            else:
+                values.append(data[offset:offset + length].decode('utf-8'))
+                offset += length
+        return values
+
+    def _may_match(self, group, where):
+        for name, (low, high) in where.iteritems():
+            least, greatest = group['chunks'][name][2:]
+            if least is None or (low is not None and greatest < low) or \
+               (high is not None and least > high):
+                return False
+        return True
+
+    def scan(self, columns=None, where=None):
+        """Yield tuples of `columns', all by default, of the rows whose
+        values are within where[name] = (low, high) for each column in
+        `where', both inclusive, None for no bound. Rows with a NULL in
+        such a column never are."""
+        columns = columns or [name for name, encoding in self.columns]
+        where = where or {}
+        for group in self.groups:
+            if not self._may_match(group, where):
+                continue
+            values = {}
+            for name in list(columns) + where.keys():
+                if name not in values:
+                    values[name] = self._chunk(group, name)
+            for i in xrange(group['rows']):
+                for name, (low, high) in where.iteritems():
+                    value = values[name][i]
+                    if value is None or (low is not None and value < low) \
+                       or (high is not None and value > high):
+                        break
+                else:
+                    yield tuple([values[name][i] for name in columns])
+
+    def close(self):
+        self.file.close()
+
+def _degrees(conn, low, high):
+    """{uid: [friends, follows, followers]} of uids low to high."""
+    degrees = {}
+    for column, sql in ((0, "SELECT user1, count(*) FROM friends WHERE "
+                            "user1 BETWEEN ? AND ? GROUP BY user1"),
+                        (0, "SELECT user2, count(*) FROM friends WHERE "
+                            "user2 BETWEEN ? AND ? GROUP BY user2"),
+                        (1, "SELECT from_user, count(*) FROM follows WHERE "
+                            "from_user BETWEEN ? AND ? GROUP BY from_user"),
+                        (2, "SELECT to_user, count(*) FROM follows WHERE "
+                            "to_user BETWEEN ? AND ? GROUP BY to_user")):
+        for uid, count in conn.execute(sql, (low, high)):
+            degrees.setdefault(uid, [0, 0, 0])[column] += count
+    return degrees
+
+def export_users(conn, path, degrees=False, group_size=ROW_GROUP):
+    """Write users, unpacked and by uid, with their numbers of friends,
+    follows and followers if `degrees'. Returns the number of rows."""
+    codec = compact.Codec(conn)
+    columns = USERS_COLUMNS + (degrees and DEGREE_COLUMNS or [])
+    writer = Writer(path, columns)
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM users ORDER BY uid")
+    while True:
+        rows = [codec.unpack(row) for row in cursor.fetchmany(group_size)]
+        if not rows: break
+        if degrees:
+            counts = _degrees(conn, rows[0][0], rows[-1][0])
+            rows = [row + tuple(counts.get(row[0], (0, 0, 0)))
+                    for row in rows]
+        writer.write_group(rows)
+    writer.close()
+    return writer.rows
+
+def export_tastes(conn, path, group_size=ROW_GROUP):
+    writer = Writer(path, TASTES_COLUMNS)
+    cursor = conn.cursor()
+    cursor.execute("SELECT uid, cat, tag, count FROM tastes ORDER BY uid")
+    while True:
+        rows = cursor.fetchmany(group_size)
+        if not rows: break
+        writer.write_group(rows)
+    writer.close()
+    return writer.rows
+
+def info(path):
+    reader = Reader(path)
+    print "%s: %d rows in %d groups, %d bytes" % \
+          (path, reader.rows, len(reader.groups), os.path.getsize(path))
+    for name, encoding in reader.columns:
+        size = sum([group['chunks'][name][1] for group in reader.groups])
+        print "  %-12s %-6s %12d bytes" % (name, encoding, size)
+    reader.close()
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-o', '--output', default=EXPORT_DIR,
+                      help='directory to write users.col to [%default]')
+    parser.add_option('-n', '--rows', type='int', default=ROW_GROUP,
+                      help='rows per group [%default]')
+    parser.add_option('--degrees', action='store_true', default=False,
+                      help='add the friends, follows and followers of users')
+    parser.add_option('--tastes', action='store_true', default=False,
+                      help='also write the tags of users to tastes.col')
+    parser.add_option('--info', action='store_true', default=False,
+                      help='describe the column files given instead')
+    options, args = parser.parse_args()
+
+    if options.info:
+        for path in args:
+            info(path)
+        return
+    db_path = args and args[0] or DB_PATH
+    conn = sqlite3.connect(db_path, timeout=60)
+    if not os.path.isdir(options.output):
+        os.makedirs(options.output)
+    path = os.path.join(options.output, 'users.col')
+    export_users(conn, path, options.degrees, options.rows)
+    info(path)
+    if options.tastes:
+        path = os.path.join(options.output, 'tastes.col')
+        export_tastes(conn, path, options.rows)
+        info(path)
+    conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#
+# Checks of the column files of columnar.py
+# author: Wu Zhe <wu@madk.org>
+#
+# Usage: python columnar_check.py
+#
+# Run from src/, the export is from an in-memory database made from
+# db.sql. Files are written to a temporary directory.
+#
+
+import os, sys, shutil, tempfile
+import columnar, storage
+
+COLUMNS = [('uid', columnar.DELTA), ('name', columnar.TEXT),
+           ('city', columnar.DICT), ('count', columnar.PLAIN)]
+CITIES = [u'\u5317\u4eac', u'\u4e0a\u6d77', None]
+
+failures = []
+
+def check(cond, message):
+    if not cond:
+        failures.append(message)
+        print "  FAIL:", message
+
+def row(i):
+    name = i % 7 and u'name \u540d %d' % i or None
+    return (1000000 + i * 3, name, CITIES[i % 3], i % 11 - 5)
+
+def write(path, rows, group_size):
+    writer = columnar.Writer(path, COLUMNS)
+    for i in xrange(0, len(rows), group_size):
+        writer.write_group(rows[i:i + group_size])
+    writer.close()
+
+def check_scan(path):
+    rows = [row(i) for i in xrange(1000)]
+    write(path, rows, 100)
+    check(not os.path.exists(path + '.part'), 'no part file left')
+    reader = columnar.Reader(path)
+    check(reader.rows == 1000 and len(reader.groups) == 10, 'groups')
+    check(list(reader.scan()) == rows, 'all columns round trip')
+    whole = reader.bytes_read
+    reader.bytes_read = 0
+    check(list(reader.scan(['count', 'uid'])) ==
+          [(r[3], r[0]) for r in rows], 'projection')
+    check(reader.bytes_read < whole / 2, 'projection reads its columns only')
+    low, high = row(250)[0], row(349)[0]
+    reader.bytes_read = 0
+    check(list(reader.scan(['name'], {'uid': (low, high)})) ==
+          [(r[1],) for r in rows[250:350]], 'uid range')
+    check(reader.bytes_read < whole / 4, 'groups out of range skipped')
+    check(list(reader.scan(['uid'], {'uid': (row(999)[0] + 1, None)})) == [],
+          'range past the last uid')
+    check(list(reader.scan(['uid'], {'city': (CITIES[0], CITIES[0])})) ==
+          [(r[0],) for r in rows if r[2] == CITIES[0]], 'dictionary range')
+    check(list(reader.scan(['uid'], {'name': (None, None)})) ==
+          [(r[0],) for r in rows if r[1] is not None], 'NULLs never match')
+    reader.close()
+
+def check_truncated(path):
+    write(path, [row(i) for i in xrange(10)], 100)
+    data = open(path, 'rb').read()
+    open(path, 'wb').write(data[:-3])
+    try:
+        columnar.Reader(path)
+        check(False, 'truncated file refused')
+    except ValueError:
+        pass
+
+def check_export(path):
+    store = storage.SQLiteStorage(':memory:')
+    rows = [(uid, 'u%d' % uid, u'\u5317\u4eac', 'nick%d' % uid,
+             'http://img3.douban.com/icon/u%d-1.jpg' % uid, None,
+             u'desc \u4e2d\u6587 %d' % uid) for uid in xrange(1, 51)]
+    store.add_users(rows)
+    store.add_friends(1, [2, 3])
+    store.add_follows(2, [1])
+    store.commit()
+    check(columnar.export_users(store.conn, path, True, 16) == 50,
+          'users exported')
+    reader = columnar.Reader(path)
+    exported = list(reader.scan())
+    check([tuple(r[:7]) for r in exported] == rows, 'users round trip')
+    check([tuple(r[-3:]) for r in exported[:3]] ==
+          [(2, 0, 1), (1, 1, 0), (1, 0, 0)], 'degrees')
+    reader.close()
+    store.close()
+
+def main():
+    path = tempfile.mkdtemp(prefix='columnar_check')
+    try:
+        for test in (check_scan, check_truncated, check_export):
+            test(os.path.join(path, test.__name__ + '.col'))
+    finally:
+        shutil.rmtree(path)
+    if failures:
+        print "%d checks failed" % len(failures)
+        sys.exit(1)
+    print "All checks passed"
+
+if __name__ == "__main__":
+    main()
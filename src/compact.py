@@ -0,0 +1,203 @@
+#
+# Compact storage of the big columns of `users'
+# author: Wu Zhe <wu@madk.org>
+#
+# Descriptions are deflated against a dictionary trained on earlier
+# descriptions and kept in the `dictionaries' table. zlib here has no
+# preset dictionaries, so a compressor that has already compressed the
+# dictionary is copied for every value, and only what it outputs after
+# that is stored.
+#
+# Locations are stored by their id in `locations', see locations.py.
+#
+# icon_url and homepage mostly are a well known prefix and the uid or
+# uid_text of the user. The prefix is stored as one control character,
+# and uid and uid_text as one more each, which never occur in URLs.
+#
+
+import zlib, struct
+
+DICT_SIZE = 16 * 1024 # bytes, must stay well under zlib's 32K window
+TRAIN_SAMPLES = 2000 # descriptions to train the dictionary on
+NGRAM = 8 # bytes in the fragments a dictionary is made of
+
+# Formats of a packed description, by its first byte
+RAW, DEFLATED, DEFLATED_DICT = '\x00', '\x01', '\x02'
+
+# Only ever append to this, packed URLs refer to it by position
+URL_PREFIXES = ('http://img1.douban.com/icon/u',
+                'http://img2.douban.com/icon/u',
+                'http://img3.douban.com/icon/u',
+                'http://img4.douban.com/icon/u',
+                'http://img5.douban.com/icon/u',
+                'http://www.douban.com/people/',
+                'http://www.douban.com/',
+                'http://',
+                'https://')
+UID_MARK, UID_TEXT_MARK = u'\x10', u'\x11'
+
+def pack_url(url, uid, uid_text):
+    if not url:
+        return url
+    for i, prefix in enumerate(URL_PREFIXES):
+        if url.startswith(prefix):
+            url = unichr(i + 1) + url[len(prefix):]
+            break
+    if uid_text and uid_text != str(uid):
+        url = url.replace(uid_text, UID_TEXT_MARK)
+    return url.replace(str(uid), UID_MARK)
+
+def unpack_url(url, uid, uid_text):
+    if not url:
+        return url
+    if url[0] < UID_MARK: # URLs stored before packing start with 'h'
+        url = URL_PREFIXES[ord(url[0]) - 1] + url[1:]
+    url = url.replace(UID_MARK, unicode(uid))
+    if uid_text:
+        url = url.replace(UID_TEXT_MARK, uid_text)
+    return url
+
+def train(samples, size=DICT_SIZE):
+    """A dictionary of the NGRAM byte fragments most common in samples,
+    the most common last, where they are the cheapest to refer to."""
+    counts = {}
+    for text in samples:
+        for i in xrange(0, len(text) - NGRAM + 1):
+            gram = text[i:i + NGRAM]
+            counts[gram] = counts.get(gram, 0) + 1
+    ranked = [(count, gram) for gram, count in counts.iteritems()
+              if count > 1]
+    ranked.sort(reverse=True)
+    pieces = [gram for count, gram in ranked[:size / NGRAM]]
+    pieces.reverse()
+    return ''.join(pieces)
+
+class _Dictionary:
+    """A compressor and decompressor primed with a dictionary."""
+
+    def __init__(self, data):
+        self.compressor = zlib.compressobj(9)
+        prefix = self.compressor.compress(data) + \
+                 self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.decompressor = zlib.decompressobj()
+        self.decompressor.decompress(prefix)
+
+    def compress(self, text):
+        c = self.compressor.copy()
+        return c.compress(text) + c.flush()
+
+    def decompress(self, data):
+        d = self.decompressor.copy()
+        return d.decompress(data) + d.flush()
+
+class Codec:
+    """Packs users rows for the database in `conn', and unpacks them.
+
+    Until a dictionary is trained, descriptions are stored deflated on
+    their own if that is shorter. The first TRAIN_SAMPLES descriptions
+    packed then train one, stored with the rows being packed.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.dictionaries = {}
+        self.current = None
+        self._load()
+        self.samples = []
+        self.location_ids = {}
+        self.location_names = {}
+
+    def _load(self):
+        for id, data in self.conn.execute("SELECT id, data FROM "
+                                          "dictionaries ORDER BY id"):
+            if id not in self.dictionaries:
+                self.dictionaries[id] = _Dictionary(str(data))
+            self.current = id
+
+    def add_dictionary(self, data):
+        cursor = self.conn.execute("INSERT INTO dictionaries (data) "
+                                   "VALUES (?)", (buffer(data),))
+        self.current = cursor.lastrowid
+        self.dictionaries[self.current] = _Dictionary(data)
+
+    def pack_description(self, text):
+        if text is None:
+            return None
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        packed = RAW + text
+        deflated = zlib.compress(text, 9)
+        if len(deflated) + 1 < len(packed):
+            packed = DEFLATED + deflated
+        if self.current is not None:
+            deflated = self.dictionaries[self.current].compress(text)
+            if len(deflated) + 3 < len(packed):
+                packed = DEFLATED_DICT + struct.pack('>H', self.current) + \
+                         deflated
+        return buffer(packed)
+
+    def unpack_description(self, data):
+        if not isinstance(data, buffer):
+            return data # stored before descriptions were packed
+        data = str(data)
+        if data[0] == DEFLATED:
+            text = zlib.decompress(data[1:])
+        elif data[0] == DEFLATED_DICT:
+            id = struct.unpack('>H', data[1:3])[0]
+            if id not in self.dictionaries: # trained by another connection
+                self._load()
+            text = self.dictionaries[id].decompress(data[3:])
+        else:
+            text = data[1:]
+        return text.decode('utf-8')
+
+    def location_id(self, name):
+        if not name:
+            return None
+        id = self.location_ids.get(name)
+        if id is None:
+            self.conn.execute("INSERT OR IGNORE INTO locations (name) "
+                              "VALUES (?)", (name,))
+            id = self.conn.execute("SELECT id FROM locations WHERE name=?",
+                                   (name,)).fetchone()[0]
+            self.location_ids[name] = id
+        return id
+
+    def location_name(self, id):
+        if id is None:
+            return None
+        name = self.location_names.get(id)
+        if name is None:
+            name = self.conn.execute("SELECT name FROM locations WHERE id=?",
+                                     (id,)).fetchone()[0]
+            self.location_names[id] = name
+        return name
+
+    def pack(self, rows):
+        """Users rows as stored, a batch at a time."""
+        if self.current is None:
+            for row in rows:
+                if row[6]:
+                    self.samples.append(isinstance(row[6], unicode) and
+                                        row[6].encode('utf-8') or row[6])
+            if len(self.samples) >= TRAIN_SAMPLES:
+                self.add_dictionary(train(self.samples))
+                self.samples = []
+        packed = []
+        for row in rows:
+            uid, uid_text = row[0], row[1]
+            packed.append((uid, uid_text, self.location_id(row[2]), row[3],
+                           pack_url(row[4], uid, uid_text),
+                           pack_url(row[5], uid, uid_text),
+                           self.pack_description(row[6])) + tuple(row[7:]))
+        return packed
+
+    def unpack(self, row):
+        """A users row as it was before pack()."""
+        if row is None:
+            return None
+        uid, uid_text = row[0], row[1]
+        return (uid, uid_text, self.location_name(row[2]), row[3],
+                unpack_url(row[4], uid, uid_text),
+                unpack_url(row[5], uid, uid_text),
+                self.unpack_description(row[6])) + tuple(row[7:])
@@ -0,0 +1,125 @@
+#
+# Checks of the packing of users rows in compact.py
+# author: Wu Zhe <wu@madk.org>
+#
+# Usage: python compact_check.py
+#
+# Run from src/, the tables are made from db.sql in an in-memory
+# database.
+#
+
+import sys, sqlite3
+import compact, migrate
+
+failures = []
+
+def check(cond, message):
+    if not cond:
+        failures.append(message)
+        print "  FAIL:", message
+
+def new_db():
+    conn = sqlite3.connect(':memory:')
+    migrate.create(conn, 'dictionaries', 'locations')
+    return conn
+
+def description(i):
+    return u'\u6211\u559c\u6b22\u8bfb\u4e66\u548c\u770b\u7535\u5f71\u3002' \
+           u'I like books, movies and music, user %d.' % i
+
+def row(uid):
+    return (uid, 'u%d' % uid, u'\u5317\u4eac', 'nick%d' % uid,
+            'http://img3.douban.com/icon/u%d-1.jpg' % uid,
+            'http://www.douban.com/people/u%d/' % uid, description(uid))
+
+def check_urls():
+    for url, uid, uid_text in (
+        ('http://img3.douban.com/icon/u1000001-2.jpg', 1000001, 'ahbei'),
+        ('http://www.douban.com/people/ahbei/', 1000001, 'ahbei'),
+        ('http://www.douban.com/people/1000002/', 1000002, '1000002'),
+        ('http://www.douban.com/people/1000003/', 1000003, None),
+        ('https://example.com/ahbei/1000001', 1000001, 'ahbei'),
+        ('ftp://example.com/', 1000001, 'ahbei'),
+        (None, 1000001, 'ahbei'), ('', 1000001, 'ahbei')):
+        packed = compact.pack_url(url, uid, uid_text)
+        check(compact.unpack_url(packed, uid, uid_text) == url,
+              'url %r round trip' % url)
+    packed = compact.pack_url('http://www.douban.com/people/ahbei/',
+                              1000001, 'ahbei')
+    check(packed == u'\x06' + compact.UID_TEXT_MARK + u'/',
+          'prefix and uid_text marked')
+    packed = compact.pack_url('http://img3.douban.com/icon/u1000001-2.jpg',
+                              1000001, 'ahbei')
+    check(packed == u'\x03' + compact.UID_MARK + u'-2.jpg',
+          'prefix and uid marked')
+    packed = compact.pack_url('http://www.douban.com/people/1000002/',
+                              1000002, '1000002')
+    check(compact.UID_TEXT_MARK not in packed,
+          'numeric uid_text marked as the uid')
+    check(compact.unpack_url('http://www.douban.com/', 1, 'u1') ==
+          'http://www.douban.com/', 'url stored before packing')
+
+def check_descriptions():
+    conn = new_db()
+    codec = compact.Codec(conn)
+    check(codec.pack_description(None) is None, 'no description')
+    short = codec.pack_description(u'hi')
+    check(str(short)[0] == compact.RAW, 'short description raw')
+    repeated = u'\u4e66' * 200
+    deflated = codec.pack_description(repeated)
+    check(str(deflated)[0] == compact.DEFLATED, 'long description deflated')
+    codec.add_dictionary(compact.train([description(i).encode('utf-8')
+                                        for i in xrange(100)]))
+    conn.commit()
+    packed = codec.pack_description(description(1000))
+    check(str(packed)[0] == compact.DEFLATED_DICT,
+          'description deflated with the dictionary')
+    for data, text in ((short, u'hi'), (deflated, repeated),
+                       (packed, description(1000))):
+        check(codec.unpack_description(data) == text,
+              'description %r round trip' % str(data)[0])
+    check(codec.unpack_description(u'plain') == u'plain',
+          'description stored before packing')
+    fresh = compact.Codec(conn)
+    check(fresh.unpack_description(packed) == description(1000),
+          'dictionary loaded by a new codec')
+
+def check_other_connection():
+    """A dictionary trained after the codec was made is loaded for it."""
+    conn = new_db()
+    reader = compact.Codec(conn)
+    writer = compact.Codec(conn)
+    writer.add_dictionary(compact.train([description(i).encode('utf-8')
+                                         for i in xrange(100)]))
+    packed = writer.pack_description(description(1000))
+    check(reader.unpack_description(packed) == description(1000),
+          'dictionary trained by another codec')
+
+def check_rows():
+    conn = new_db()
+    codec = compact.Codec(conn)
+    rows = [row(uid) for uid in xrange(1, compact.TRAIN_SAMPLES + 501)]
+    packed = []
+    for i in xrange(0, len(rows), 100):
+        packed.extend(codec.pack(rows[i:i + 100]))
+    check(codec.current is not None, 'dictionary trained')
+    check(str(packed[-1][6])[0] == compact.DEFLATED_DICT,
+          'rows packed with the dictionary')
+    check(len(set([p[2] for p in packed])) == 1, 'location stored once')
+    fresh = compact.Codec(conn)
+    check([fresh.unpack(p) for p in packed] == rows, 'rows round trip')
+    check(fresh.unpack(packed[0] + ('2008-01-01',)) == rows[0] +
+          ('2008-01-01',), 'columns after description kept')
+    check(fresh.unpack(None) is None, 'no row')
+
+def main():
+    for test in (check_urls, check_descriptions, check_other_connection,
+                 check_rows):
+        test()
+    if failures:
+        print "%d checks failed" % len(failures)
+        sys.exit(1)
+    print "All checks passed"
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,12 @@
 # author: Wu Zhe <wu@madk.org>
 #
 
-import douban.service
-import os, sys, sqlite3, atexit, pickle, datetime, time, socket, gdata, signal
+import douban, douban.service
+import ratecontrol, metrics, tastes, popest, decoder
+import archive, storage, target
+from profiling import PROFILER
+import os, sys, atexit, pickle, datetime, time, socket, gdata, signal
+import optparse
 from collections import deque
 from gdata.service import RequestError
 
@@ -18,287 +22,525 @@ def open_and_read(path):
 APIKEY = open_and_read(os.path.normpath('../API_KEY')).split('\n')[0]
 SECRET = ''
 
-# Path settings
-SQL_PATH = os.path.normpath('db.sql')
-DB_PATH = os.path.normpath('../data.db') # sqlite3 database
-USER_PATH = os.path.normpath('../user_queue.pkl') # pickle
-VISITED_PATH = os.path.normpath('../visited_users.pkl') # pickle
+# Path settings, see storage.py for where users are kept
+TASTES_PATH = os.path.normpath('../tastes_queue.pkl') # pickle
+POPULATION_PATH = os.path.normpath('../population.pkl') # pickle
 
-SEED_USERS = (1000001, 2461197, 1021991) # seed UIDs
+SEED_USERS = (1000001, 2461197, 1021991) # seed UIDs, unless --seed
 REQ_CONTROL = True # control request frenquency or not
 REQ_INTERVAL = 60.0/42 # Minimum interval between reqs, API TOS says I
                        # can't req faster than 40 per min
 MAX_RESULTS = 50 # max-results per page in douban API, currently API
                  # limits it to 50
-TOTAL_USERS = 2000000 # Estimated number of user accounts in douban
+TASTES_REQ_INTERVAL = 60.0/10 # --tastes requests, taken out of the
+                              # REQ_INTERVAL budget of the BFS as both
+                              # use the same API key
+PROBE_EVERY = 20 # probe a random uid every this many visited users, to
+                 # estimate the number of users in douban
 TIMEOUT_LIMIT = 10
+FETCH_TTL = 90 # days before a list fetched from the API is fetched again
+PREFETCH_AHEAD = 200 # frontier users read from the database at once,
+                     # keep it under 450 for sqlite's 999 variables
+DECODE_WORKERS = None # processes decoding responses, None for one per
+                      # core, 0 to decode in the crawler itself
+PROFILE_PATH = os.path.normpath('../profile') # default for --profile
+STATS_WINDOW = 50 # RF and VF are averaged over this many visited users
+
+# Metrics settings
+METRICS_PORT = 9108 # serve metrics on localhost, None to disable
+METRICS_PATH = os.path.normpath('../metrics.txt') # periodic snapshot
+METRICS_INTERVAL = 60 # seconds between snapshots
 
 def nowp():
     return '[' + datetime.datetime.now().isoformat(' ') + ']'
 
 class TimeoutError(Exception): pass
 
+class NotFoundError(Exception): pass
+
 def signal_handler(signum, frame):
     raise TimeoutError()
 signal.signal(signal.SIGALRM, signal_handler)
 
+def raw_response(text):
+    """Converter for client.Get, leaving the decoding to User.decode_pool."""
+    return text
+
 class User:
 
     # Map fields in `users' table to douban_python gdata api methods
-    Mapper = (('uid', lambda x: int(x.GetSelfLink().href.split('/')[-1])),
-              ('uid_text', lambda x: x.uid.text),
-              ('location', lambda x: x.location.text),
-              ('nickname', lambda x: x.title.text),
-              ('icon_url', lambda x: x.link[2].href),
-              ('homepage', lambda x: x.link[3].href),
-              ('description', lambda x: x.content.text))
-
-    Sleep_Timeout_init = 2 # 2 seconds
-    Sleep_Banned_init = 3600 + 5 # retry in 1 hour, douban remove ban
-                                 # after 1 hour
-    last_req_time = 0
-
-    def __init__(self, db_cursor, client, uri_id):
-        self.db_cursor = db_cursor
+    Mapper = decoder.MAPPER
+
+    # Shared by all users: paces requests, backs off on timeouts and
+    # waits out bans
+    rate_controller = ratecontrol.RateController(
+        REQ_CONTROL and REQ_INTERVAL or 0)
+
+    # Shared by all users: turns responses into rows, main() replaces it
+    # with one with DECODE_WORKERS processes
+    decode_pool = decoder.DecodePool(0)
+
+    # Shared by all users: every response goes in here with --archive
+    archive = None
+
+    def __init__(self, storage, client, uri_id, known=None, seen=None):
+        self.storage = storage
         self.client = client
         self.uri_id = uri_id # uri_id is either uid or uid_text
+        self.known = known # what prefetch() found in the database
+        # uids already in the database, shared with the caller
+        if seen is None:
+            seen = set()
+        self.seen = seen
+        self.new_users = set() # neighbours this user added to the database
+        self.locations = {} # uid -> location of everyone on fetched pages
         self.data = []
-        self.rows_store = {}
-        self.friend_pairs = []
-        self.contact_pairs = [] # actually means `follows' in database
         self.api_req_count = 0
+        self.store_time = 0
 
     def _req_api(self, what, uri):
-        if what == 'people':
-            getter = self.client.GetPeople
-        elif what == 'friends':
-            getter = self.client.GetFriends
-
-        # Sleep if request too fast
-        now = time.time()
-        if REQ_CONTROL and (now - User.last_req_time) < REQ_INTERVAL:
-            sleep_time = REQ_INTERVAL - (now - User.last_req_time)
-            print nowp() + " zzZ for %s seconds, to be polite" % sleep_time
-            time.sleep(sleep_time)
-
-        timeout = User.Sleep_Timeout_init
-        banned = User.Sleep_Banned_init
+        """The raw response to uri, see decode_pool for the decoding."""
+        rate = User.rate_controller
         while True:
+            # Sleep if request too fast, or while backing off
+            sleep_time = rate.delay()
+            if sleep_time > 0:
+                if rate.state != ratecontrol.CLOSED:
+                    print nowp() + " zzZ for %s seconds, breaker %s" % \
+                          (sleep_time, rate.state)
+                elif rate.failures:
+                    print nowp() + " ** Connection timeout, retry in %s " \
+                          "seconds" % sleep_time
+                else:
+                    print nowp() + " zzZ for %s seconds, to be polite" % \
+                          sleep_time
+                time.sleep(sleep_time)
+                PROFILER.add('sleep', sleep_time)
+            rate.start()
+            begin = time.time()
             signal.alarm(TIMEOUT_LIMIT)
             try:
-                f = getter(uri)
+                text = self.client.Get(uri, {}, converter=raw_response)
             except (TimeoutError, socket.error):
-                print nowp() + " ** Connection timeout, retry in %s seconds" % \
-                      timeout
                 signal.alarm(0) # disable the alarm
-                time.sleep(timeout)
-                timeout *= 2
-            except RequestError:
-                print nowp() + " ** I am miserably banned, retry in %s hours" % \
-                      (banned/3600.0)
+                rate.failure()
+                metrics.REQUESTS.labels(what, 'timeout').inc()
+                metrics.RETRIES.inc()
+            except RequestError, e:
                 signal.alarm(0)
-                time.sleep(banned)
-                banned *= 2
+                if e.args and isinstance(e.args[0], dict) and \
+                       e.args[0].get('status') == 404:
+                    rate.success(time.time() - begin)
+                    metrics.REQUESTS.labels(what, 'not_found').inc()
+                    if User.archive:
+                        User.archive.append(uri, 404)
+                    raise NotFoundError(uri)
+                rate.banned()
+                metrics.REQUESTS.labels(what, 'banned').inc()
+                metrics.BANS.inc()
+                print nowp() + " ** I am miserably banned, retry in %.2f " \
+                      "hours" % (rate.delay()/3600.0)
             else:
+                latency = time.time() - begin
+                rate.success(latency)
+                metrics.REQUESTS.labels(what, 'ok').inc()
+                metrics.REQUEST_SECONDS.labels(what).observe(latency)
+                if User.archive:
+                    User.archive.append(uri, 200, text)
                 break
             finally:
                 signal.alarm(0)
-        User.last_req_time = time.time()
+                PROFILER.add('fetch', time.time() - begin)
+        metrics.REQUEST_RATE.set(rate.rate or 0)
         self.api_req_count += 1
-        return f
-
-    def _get_userlist_from_api(self, what):
-        entries = []
+        return text
+
+    def _decoded(self, what, pending):
+        """Wait for the rows decode_pool makes of a response."""
+        begin = time.time()
+        rows, decode_time = pending.get(decoder.DECODE_TIMEOUT)
+        PROFILER.add('decode', time.time() - begin)
+        metrics.PARSE_SECONDS.labels(what).observe(decode_time)
+        return rows
+
+    def _pages(self, what, uri, kind):
+        """The rows on each page of the feed at uri, decoded as `kind'
+        while the next page is fetched. Requests and decoding are
+        counted under `what'."""
+        sep = '?' in uri and '&' or '?'
+        pending = None
         start_i = 1
-        while start_i == 1 or len(f.entry) == 50:
-            f = self._req_api('friends',
-                              '/people/%s/%s?start-index=%s&max-results=%s' % \
-                              (self.uri_id, what, start_i, MAX_RESULTS))
-            entries.extend(f.entry)
+        entries = MAX_RESULTS
+        while entries == MAX_RESULTS:
+            text = self._req_api(what, '%s%sstart-index=%s&max-results=%s' %
+                                 (uri, sep, start_i, MAX_RESULTS))
+            entries = decoder.count_entries(text)
+            if pending is not None:
+                yield self._decoded(what, pending)
+            pending = User.decode_pool.submit(kind, text)
             start_i += MAX_RESULTS
+        yield self._decoded(what, pending)
 
-        rows = []
-        for e in entries:
-            fields = []
-            for field, getter in User.Mapper:
-                try:
-                    fields.append(getter(e))
-                except (AttributeError, IndexError):
-                    fields.append(None)
-            rows.append(fields)
-        uid_list = [fields[0] for fields in rows]
-        rows_store = dict(zip(uid_list, rows))
-        self.rows_store.update(rows_store)
-        vars(self)[what[:-1] + '_pairs'] = \
-                      zip((self.get_data()[0],) * len(uid_list), uid_list)
-        return set(uid_list)
+    def _get_userlist_from_api(self, what):
+        """Page through the friends or contacts of the user, storing each
+        page as it arrives, and return the uids in the list.
+
+        A user stored from someone else's list may be gone by now. Then
+        the list is what was fetched before the 404, usually nothing,
+        and is logged as fetched all the same so it is not asked again.
+        """
+        uid = self.get_data()[0]
+        uids = set()
+        # By uid, so that archived pages say whose list they are
+        try:
+            for rows in self._pages(what, '/people/%s/%s' % (uid, what),
+                                    'friends'):
+                self._store_page(what, uid, rows)
+                uids.update([row[0] for row in rows])
+        except NotFoundError:
+            print nowp() + " ** User %s is gone, no %s" % (uid, what)
+        self._log_fetch(uid, what, len(uids))
+        return uids
+
+    def _store_page(self, what, uid, rows):
+        """Store the users on one page of uid's list we have not seen
+        before, and the edges to all of them."""
+        begin = time.time()
+        new_rows = []
+        for row in rows:
+            self.locations[row[0]] = row[2]
+            if row[0] not in self.seen:
+                self.seen.add(row[0])
+                self.new_users.add(row[0])
+                new_rows.append(row)
+        self.storage.add_users(new_rows)
+
+        others = [row[0] for row in rows]
+        if what == 'friends':
+            self.storage.add_friends(uid, others)
+        else: # contacts, that is `follows' in database
+            self.storage.add_follows(uid, others)
+        elapsed = time.time() - begin
+        self.store_time += elapsed
+        PROFILER.add('store', elapsed)
+
+    def _fetched_size(self, uid, what):
+        """Entries in the list when last fetched, None if it is due."""
+        if self.known is not None:
+            return self.known['fetched'].get(what)
+        return self._query(self.storage.fetched, uid, what, FETCH_TTL)
+
+    def _list_fetched(self, what):
+        return self._fetched_size(self.get_data()[0], what) is not None
+
+    def _log_fetch(self, uid, what, size):
+        # Committed together with what was fetched
+        self.storage.log_fetch(uid, what, size)
+
+    def _query(self, method, *args):
+        begin = time.time()
+        result = method(*args)
+        PROFILER.add('query', time.time() - begin)
+        return result
 
     def _store_userdata(self):
-        self.db_cursor.execute("SELECT count(*) FROM users WHERE uid=?",
-                               (self.data[0],))
-        if not self.db_cursor.fetchone()[0]:
-            self.db_cursor.execute("INSERT INTO users VALUES " +
-                                   "(?,?,?,?,?,?,?,DATETIME('NOW'))",
-                                   self.data)
+        begin = time.time()
+        self.storage.add_users([self.data])
+        PROFILER.add('store', time.time() - begin)
 
     def get_data(self):
         if self.data: return self.data
+        if self.known is not None and self.known['data']:
+            self.data = self.known['data']
+            return self.data
 
-        self.db_cursor.execute("SELECT * FROM users WHERE uid=? OR uid_text=?",
-                               (self.uri_id, str(self.uri_id)))
-        row = self.db_cursor.fetchone()
+        row = self._query(self.storage.user, self.uri_id)
         if row:
             self.data = row
             return self.data
 
-        # If not in database, get it via API and save it in database
-        p = self._req_api('people', '/people/%s' % self.uri_id)
-        fields = []
-        for field, getter in User.Mapper:
-            try:
-                fields.append(getter(p))
-            except (AttributeError, IndexError):
-                fields.append(None)
-        self.data = fields
+        # If not in database, get it via API and save it in database,
+        # unless we know the user is gone
+        if self._fetched_size(self.uri_id, 'people') == 0:
+            raise NotFoundError(self.uri_id)
+        try:
+            text = self._req_api('people', '/people/%s' % self.uri_id)
+        except NotFoundError:
+            self._log_fetch(self.uri_id, 'people', 0)
+            raise
+        self.data = self._decoded('people',
+                                  User.decode_pool.submit('people', text))
         self._store_userdata()
+        self._log_fetch(self.data[0], 'people', 1)
         return self.data
 
-    def store_users(self, uids):
-        rows = filter(lambda x: x[0] in uids, self.rows_store.values())
-        self.db_cursor.executemany("INSERT INTO users VALUES " +
-                                   "(?,?,?,?,?,?,?,DATETIME('NOW'))",
-                                   rows)
-
-    def store_relations(self):
-        new_friend_pairs = []
-        for pair in self.friend_pairs:
-            self.db_cursor.execute("SELECT count(*) FROM friends " +
-                                   "WHERE user2=? AND user1=?", pair)
-            if self.db_cursor.fetchone()[0] == 0:
-                new_friend_pairs.append(pair)
-        self.db_cursor.executemany("INSERT INTO friends VALUES (?, ?)",
-                                   new_friend_pairs)
-        self.db_cursor.executemany("INSERT INTO follows VALUES (?, ?)",
-                                   self.contact_pairs)
+    def _adjacent(self, what, uid):
+        """Frozenset of uid's friends, follows or followers."""
+        return frozenset(self._query(getattr(self.storage, what), uid))
 
     def get_friends(self):
-        self.db_cursor.execute('SELECT user2 FROM friends WHERE user1=?',
-                               (self.get_data()[0],))
-        set1 = set([x[0] for x in self.db_cursor.fetchall()])
-        if not set1:
-            set1 = self._get_userlist_from_api('friends')
-        self.db_cursor.execute('SELECT user1 FROM friends WHERE user2=?',
-                               (self.get_data()[0],))
-        set2 = set([x[0] for x in self.db_cursor.fetchall()])
-        friends = set1 | set2
+        uid = self.get_data()[0]
+        if self.known is not None:
+            friends = frozenset(self.known['friends'])
+        else:
+            friends = self._adjacent('friends', uid)
+        # Pairs in the database may come from other users' lists only
+        if not self._list_fetched('friends'):
+            friends |= self._get_userlist_from_api('friends')
         return friends
 
     def get_follows(self):
-        self.db_cursor.execute('SELECT to_user FROM follows WHERE from_user=?',
-                               (self.get_data()[0],))
-        follows = set([x[0] for x in self.db_cursor.fetchall()])
-        if not follows:
-            follows = self._get_userlist_from_api('contacts')
+        if self.known is not None:
+            follows = frozenset(self.known['follows'])
+        else:
+            follows = self._adjacent('follows', self.get_data()[0])
+        if not self._list_fetched('contacts'):
+            follows |= self._get_userlist_from_api('contacts')
         return follows
 
     def get_followers(self):
-        self.db_cursor.execute('SELECT from_user FROM follows WHERE to_user=?',
-                               (self.get_data()[0],))
-        followers = set([x[0] for x in self.db_cursor.fetchall()])
-        return followers
+        return self._adjacent('followers', self.get_data()[0])
 
     def get_tags(self):
-        # get book (tag, count)
-        pass
-        return set([])
+        """(cat, tag, count) of the tags on the user's collections, as
+        far as tastes.TastesCrawler has fetched them."""
+        return set(self._query(self.storage.tags, self.get_data()[0]))
 
 def main():
-    # Connect to database, create it if not exists.
-    if not os.path.exists(DB_PATH):
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.executescript(open_and_read(SQL_PATH))
-        conn.commit()
-    else:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-    cursor.execute("PRAGMA cache_size = 20000;")
-    cursor.execute("PRAGMA synchronous = NORMAL;")
-    cursor.execute("PRAGMA temp_store = MEMORY;")
-
-    # Get the user list to crawl
-    if not os.path.exists(USER_PATH):
-        curr_list = SEED_USERS
-        queue = deque(curr_list)
+    parser = optparse.OptionParser()
+    parser.add_option('--tastes', action='store_true', default=False,
+                      help='also collect the tags of visited users, in the '
+                      'background at one request per %.1f seconds, which '
+                      'slows down the BFS as much' % TASTES_REQ_INTERVAL)
+    parser.add_option('--profile', action='store_true', default=False,
+                      help='write per-user span times and a sampled profile '
+                      'of the crawl to %s.*' % PROFILE_PATH)
+    parser.add_option('--archive', action='store_true', default=False,
+                      help='append every API response to %s, for '
+                      'rebuild.py' % archive.ARCHIVE_PATH)
+    parser.add_option('--storage', type='choice', choices=('sqlite', 'log'),
+                      default='sqlite',
+                      help='keep users in %s (sqlite), or in append-only '
+                      'logs in %s for bulk crawls (log) [%%default]' %
+                      (storage.DB_PATH, storage.LOG_PATH))
+    parser.add_option('--seed', action='append', dest='seeds', default=[],
+                      metavar='UID', help='start from this uid or uid_text '
+                      'instead of %s, may be repeated' % (SEED_USERS,))
+    parser.add_option('--hops', type='int', default=None,
+                      help='only visit users this many hops from the seeds')
+    parser.add_option('--location', action='append', dest='locations',
+                      default=[], metavar='NAME',
+                      help='only visit users in this location, may be '
+                      'repeated')
+    parser.add_option('--min-degree', type='int', default=1, metavar='N',
+                      help='only visit the neighbours of users with N '
+                      'friends and contacts or more [%default]')
+    parser.add_option('--target-state', default=target.TARGET_PATH,
+                      metavar='PATH', help='where a crawl limited by the '
+                      'options above keeps its frontier [%default]')
+    options, args = parser.parse_args()
+    if options.tastes and options.storage != 'sqlite':
+        parser.error('--tastes needs --storage=sqlite')
+    seeds = [x.isdigit() and int(x) or x for x in options.seeds] or SEED_USERS
+    targeted = options.hops is not None or options.locations or \
+               options.min_degree > 1
+
+    # Open the storage, creating it if it does not exist
+    try:
+        if options.storage == 'sqlite':
+            store = storage.SQLiteStorage()
+        else:
+            store = storage.LogStorage()
+    except storage.StorageError, e:
+        print e
+        sys.exit(1)
+
+    # Get the user list to crawl and the visited users. A targeted crawl
+    # keeps its own, so that it can run between runs of the full one.
+    goal = None
+    if targeted:
+        state = target.load(options.target_state)
+        if state:
+            queue, visited, goal = state
+            print "Restoring targeted crawl (%s) from %s" % \
+                  (goal.describe(), options.target_state)
+            print "=" * 8
+        else:
+            queue, visited = deque(seeds), set()
+            locations = [x.decode('utf-8') for x in options.locations]
+            goal = target.Target(seeds, options.hops, locations,
+                                 options.min_degree)
+            print "Targeted crawl: %s" % goal.describe()
     else:
-        print "Restoring running state from the previous run"
-        print "=" * 8
-        pkl_file = open(USER_PATH, 'rb')
-        queue = pickle.load(pkl_file)
-        pkl_file.close()
-
-    # Get the visited user list
-    if not os.path.exists(VISITED_PATH):
-        visited = set([])
-    else:
-        pkl_file = open(VISITED_PATH)
-        visited = pickle.load(pkl_file)
-        pkl_file.close()
+        if os.path.exists(store.queue_path):
+            print "Restoring running state from the previous run"
+            print "=" * 8
+        queue, visited = store.load_frontier(seeds)
+
+    # Decode responses in worker processes, forked before any threads
+    User.decode_pool = decoder.DecodePool(DECODE_WORKERS)
+    atexit.register(User.decode_pool.close)
+    if options.archive:
+        User.archive = archive.Archive()
+        atexit.register(User.archive.close)
+
+    # Collect tastes of visited users in a pipeline of their own
+    tastes_crawler = None
+    if options.tastes:
+        if REQ_CONTROL:
+            # Together under the REQ_INTERVAL limit of the API key
+            User.rate_controller = ratecontrol.RateController(
+                1.0 / (1.0 / REQ_INTERVAL - 1.0 / TASTES_REQ_INTERVAL))
+        socket.setdefaulttimeout(TIMEOUT_LIMIT) # no SIGALRM in threads
+        tastes_crawler = tastes.TastesCrawler(storage.DB_PATH, APIKEY,
+                                              TASTES_REQ_INTERVAL, FETCH_TTL,
+                                              archive=User.archive)
+        if os.path.exists(TASTES_PATH):
+            pkl_file = open(TASTES_PATH, 'rb')
+            for uid in pickle.load(pkl_file):
+                tastes_crawler.add(uid)
+            pkl_file.close()
+        tastes_crawler.start()
 
     # Set up the exit function
-    def save_state(conn, cursor, queue, visited):
+    def save_state(store, queue, visited):
         print "=" * 8
         print "Saving running state ..."
-        if queue:
-            pkl_file = open(USER_PATH, 'wb')
-            pickle.dump(queue, pkl_file)
-            pkl_file.close()
-        if visited:
-            pkl_file = open(VISITED_PATH, 'wb')
-            pickle.dump(visited, pkl_file)
+        if goal:
+            target.save(options.target_state, queue, visited, goal)
+            print "%d users pruned so far" % len(goal.pruned)
+        else:
+            store.save_frontier(queue, visited)
+        if tastes_crawler:
+            pkl_file = open(TASTES_PATH, 'wb')
+            pickle.dump(tastes_crawler.stop(), pkl_file)
             pkl_file.close()
-        cursor.execute("SELECT count(*) FROM users")
-        count = cursor.fetchone()[0]
-        conn.close()
+        count = store.count_users()
+        store.close()
         print "Sir, I have collected %d users for you so far." % count
-    atexit.register(save_state, conn, cursor, queue, visited)
+    atexit.register(save_state, store, queue, visited)
+    if options.profile:
+        PROFILER.start(PROFILE_PATH)
+        atexit.register(PROFILER.stop)
 
     client = douban.service.DoubanService(api_key=APIKEY)
-    cursor.execute("SELECT uid FROM users")
-    users_in_db = set([x[0] for x in cursor.fetchall()])
+    users_in_db = store.uids()
+
+    # Rebuild the population estimate, keeping probes of previous runs
+    if not os.path.exists(POPULATION_PATH):
+        population = popest.PopulationEstimator()
+    else:
+        pkl_file = open(POPULATION_PATH, 'rb')
+        population = pickle.load(pkl_file)
+        pkl_file.close()
+        population.known = population.max_offset = 0
+    for uid in users_in_db:
+        population.add(uid)
+    def save_population(population):
+        pkl_file = open(POPULATION_PATH, 'wb')
+        pickle.dump(population, pkl_file)
+        pkl_file.close()
+    atexit.register(save_population, population)
+
+    if METRICS_PORT:
+        metrics.REGISTRY.serve(METRICS_PORT)
+    if METRICS_PATH:
+        metrics.REGISTRY.snapshot_every(METRICS_PATH, METRICS_INTERVAL)
 
     # BFS crawl
     new_reqs = 0
     total_reqs = 0
     queue_length = len(queue)
+    recent = deque() # (begin_time, reqs) of the last visited users
+    known = {}
     while queue:
         curr_uid = queue.popleft()
         if curr_uid in visited: continue
+        if goal and curr_uid in goal.pruned: continue
 
         # API heavy operations
         begin_time = time.time()
-        user = User(cursor, client, curr_uid)
-        uid = user.get_data()[0]
-        users_in_db.add(uid)
-        user_users = user.get_friends() | user.get_follows()
+        PROFILER.begin_user()
+        if curr_uid not in known:
+            upcoming = [curr_uid]
+            for uri_id in queue:
+                if len(upcoming) == PREFETCH_AHEAD: break
+                if uri_id not in visited and uri_id not in upcoming:
+                    upcoming.append(uri_id)
+            begin = time.time()
+            known = store.prefetch(upcoming, FETCH_TTL)
+            PROFILER.add('query', time.time() - begin)
+        user = User(store, client, curr_uid, known.pop(curr_uid), users_in_db)
+        try:
+            uid = user.get_data()[0]
+        except NotFoundError:
+            print nowp() + " ** User %s is gone" % curr_uid
+            visited.add(curr_uid)
+            continue
+        if uid not in users_in_db:
+            users_in_db.add(uid)
+            population.add(uid)
+        if goal:
+            goal.visit(curr_uid, uid)
+        # Pages of neighbours are stored as they arrive, and the users new
+        # to us added to users_in_db
+        neighbours = user.get_friends() | user.get_follows()
         end_time = time.time()
 
-        # CPU heavy operations
-        new_users = user_users - users_in_db
-        user.store_users(new_users)
-        user.store_relations()
-        conn.commit()
-        users_in_db |= new_users
+        new_users = user.new_users
+        commit_begin = time.time()
+        if User.archive:
+            User.archive.flush() # never store what could not be rebuilt
+        store.commit()
+        store_end = time.time()
+        metrics.DB_WRITE_SECONDS.observe(user.store_time +
+                                         store_end - commit_begin)
+        PROFILER.add('commit', store_end - commit_begin)
+        PROFILER.end_user(uid, store_end - begin_time)
+        for new_uid in new_users:
+            population.add(new_uid)
         visited.add(curr_uid)
-        queue.extend(new_users)
-
-        # Update the frequency stats
-        duration = end_time - begin_time
+        if goal:
+            # Neighbours stored before count too, in a targeted crawl
+            def location(other):
+                if other in user.locations:
+                    return user.locations[other]
+                row = store.user(other)
+                return row and row[2]
+            queue.extend(goal.expand(uid, sorted(neighbours), location))
+        else:
+            queue.extend(new_users)
+        if tastes_crawler:
+            tastes_crawler.add(uid)
+
+        # Does a random uid exist? Known ones are free to check. Not in a
+        # targeted crawl, which only visits users near the seeds.
+        if not goal and len(visited) % PROBE_EVERY == 0:
+            probe_uid = population.probe_uid()
+            exists = probe_uid in users_in_db
+            if not exists:
+                try:
+                    User(store, client, probe_uid).get_data()
+                    store.commit()
+                    users_in_db.add(probe_uid)
+                    population.add(probe_uid)
+                    queue.append(probe_uid)
+                    exists = True
+                except NotFoundError:
+                    pass
+            population.add_probe(exists)
+
+        # Update the frequency stats over the last STATS_WINDOW users
         new_reqs = user.api_req_count
-        req_freq = int(60.0 * new_reqs / duration) # reqs per min
-        visit_freq = int(3600.0 / duration) # visit per hour
+        recent.append((begin_time, new_reqs))
+        if len(recent) > STATS_WINDOW:
+            recent.popleft()
+        duration = max(end_time - recent[0][0], 0.001)
+        req_freq = int(60.0 * sum([r for t, r in recent]) / duration)
+        visit_freq = int(3600.0 * len(recent) / duration) # visit per hour
         # estimated time remaining
-        etr = int((TOTAL_USERS - len(visited)) / visit_freq) \
+        total_users, total_low, total_high = population.estimate()
+        etr = int((total_users - len(visited)) / visit_freq) \
               if visit_freq != 0 else sys.maxint
 
         # Stats printing
@@ -306,10 +548,15 @@ def main():
         new_queue_length = len(queue)
         queue_delta = new_queue_length - queue_length
         queue_length = new_queue_length
-        print "%s V:%d Q:%d(%+d) D:%d(%+d) R:%d(%+d) RF:%d VF:%d ETR:%d U:%s(%s)" % \
+        metrics.QUEUE_DEPTH.set(queue_length)
+        metrics.VISITED.set(len(visited))
+        metrics.USERS_IN_DB.set(len(users_in_db))
+        metrics.ESTIMATED_USERS.set(total_users)
+        print "%s V:%d Q:%d(%+d) D:%d(%+d) R:%d(%+d) RF:%d VF:%d N:%d(%d-%d) ETR:%d U:%s(%s)" % \
               (nowp(), len(visited), queue_length, queue_delta,
                len(users_in_db), len(new_users), total_reqs, new_reqs, req_freq,
-               visit_freq, etr, user.data[1], user.data[3])
+               visit_freq, total_users, total_low, total_high, etr,
+               user.data[1], user.data[3])
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,123 @@
+#
+# Checks of crawler.User against a fake douban API
+# author: Wu Zhe <wu@madk.org>
+#
+# Usage: python crawler_check.py
+#
+# Run from src/ like the crawler, which reads ../API_KEY when imported.
+# No request leaves the machine: FakeClient answers from dicts of
+# friends and contacts, with 404 for the users listed as gone.
+#
+
+import sys
+from gdata.service import RequestError
+import crawler, storage, ratecontrol, target, metrics
+
+PERSON = '<entry xmlns="http://www.w3.org/2005/Atom" ' \
+         'xmlns:db="http://www.douban.com/xmlns/">' \
+         '<id>http://api.douban.com/people/%(uid)d</id>' \
+         '<title>nick%(uid)d</title><db:uid>u%(uid)d</db:uid>' \
+         '<db:location>Beijing</db:location><content>desc</content>' \
+         '<link href="http://api.douban.com/people/%(uid)d" rel="self"/>' \
+         '<link href="http://www.douban.com/people/u%(uid)d/" ' \
+         'rel="alternate"/>' \
+         '<link href="http://img3.douban.com/icon/u%(uid)d-1.jpg" ' \
+         'rel="icon"/></entry>'
+FEED = '<feed xmlns="http://www.w3.org/2005/Atom" ' \
+       'xmlns:db="http://www.douban.com/xmlns/">%s</feed>'
+
+class FakeClient:
+    """Answers client.Get like DoubanService, recording the URIs."""
+
+    def __init__(self, friends, contacts, gone=()):
+        self.lists = {'friends': friends, 'contacts': contacts}
+        self.gone = set(gone)
+        self.requests = []
+
+    def Get(self, uri, extra_headers=None, converter=None):
+        self.requests.append(uri)
+        path, query = (uri.split('?') + [''])[:2]
+        parts = path.split('/') # '', 'people', uid[, list]
+        uid = int(parts[2])
+        if uid in self.gone:
+            raise RequestError({'status': 404, 'reason': 'Not Found',
+                                'body': ''})
+        if len(parts) == 3:
+            return converter(PERSON % {'uid': uid})
+        params = dict([p.split('=') for p in query.split('&')])
+        start = int(params['start-index']) - 1
+        others = self.lists.get(parts[3], {}).get(uid, [])
+        page = others[start:start + int(params['max-results'])]
+        return converter(FEED % ''.join([PERSON % {'uid': other}
+                                         for other in page]))
+
+failures = []
+
+def check(cond, message):
+    if not cond:
+        failures.append(message)
+        print "  FAIL:", message
+
+def visit(store, client, uid):
+    """What main() does for one user of the queue."""
+    known = store.prefetch([uid], crawler.FETCH_TTL)[uid]
+    user = crawler.User(store, client, uid, known, store.uids())
+    user.get_data()
+    neighbours = user.get_friends() | user.get_follows()
+    store.commit()
+    return neighbours
+
+def check_gone_lists(store):
+    """A stored user whose lists 404 is visited with no neighbours."""
+    client = FakeClient({1: [2, 3]}, {}, gone=[3])
+    visit(store, client, 1)
+    check(store.user(3) is not None, 'gone user stored from a list')
+    check(visit(store, client, 3) == frozenset([1]),
+          'gone user keeps the friends stored')
+    check(store.fetched(3, 'friends', 90) == 0 and
+          store.fetched(3, 'contacts', 90) == 0, 'gone lists logged')
+    requests = len(client.requests)
+    visit(store, client, 3)
+    check(len(client.requests) == requests, 'gone lists not asked again')
+
+def check_min_degree(store):
+    """Only users with min_degree neighbours are expanded from."""
+    client = FakeClient({1: [2, 3], 3: [4, 5]}, {})
+    goal = target.Target([1], hops=2, min_degree=2)
+    queue = [1]
+    while queue:
+        uri_id = queue.pop(0)
+        goal.visit(uri_id, uri_id)
+        neighbours = visit(store, client, uri_id)
+        queue.extend(goal.expand(uri_id, sorted(neighbours),
+                                 lambda other: None))
+    check(sorted(goal.hops) == [1, 2, 3, 4, 5], 'neighbours of a seed visited')
+    check(goal.hops[4] == 2, 'hops counted')
+    goal = target.Target([1], min_degree=3)
+    goal.visit(1, 1)
+    check(goal.expand(1, [2, 3], lambda other: None) == [],
+          'dead end not expanded')
+
+def check_list_metrics(store):
+    """Contacts pages are counted under contacts, not friends."""
+    client = FakeClient({1: [2]}, {1: [3, 4]})
+    before = dict([(what, metrics.REQUESTS.labels(what, 'ok').value)
+                   for what in ('friends', 'contacts')])
+    visit(store, client, 1)
+    for what in ('friends', 'contacts'):
+        check(metrics.REQUESTS.labels(what, 'ok').value - before[what] == 1,
+              '%s requests counted' % what)
+
+def main():
+    crawler.User.rate_controller = ratecontrol.RateController(0)
+    for test in (check_gone_lists, check_min_degree, check_list_metrics):
+        store = storage.SQLiteStorage(':memory:')
+        test(store)
+        store.close()
+    if failures:
+        print "%d checks failed" % len(failures)
+        sys.exit(1)
+    print "All checks passed"
+
+if __name__ == "__main__":
+    main()
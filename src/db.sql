@@ -1,33 +1,167 @@
 -- database schema
 -- author: Wu Zhe <wu@madk.org>
+--
+-- Bump user_version with every migration added to migrate.py. The
+-- migrations create tables, indexes and triggers from the statements
+-- in here, so give each its own name and IF NOT EXISTS.
+
+PRAGMA user_version = 8;
+
+CREATE TABLE IF NOT EXISTS locations (
+       id INTEGER PRIMARY KEY,
+       name TEXT UNIQUE
+);
 
 CREATE TABLE IF NOT EXISTS users (
        uid INTEGER,
        uid_text TEXT,
-       location TEXT,
+       location_id INTEGER REFERENCES locations (id),
        nickname TEXT,
        icon_url TEXT,
        homepage TEXT,
-       description BLOB,
+       description BLOB, -- packed, see compact.py
        created DATE,
        PRIMARY KEY (uid)
 );
 
+-- Trained dictionaries for users.description
+CREATE TABLE IF NOT EXISTS dictionaries (
+       id INTEGER PRIMARY KEY,
+       data BLOB
+);
+
+CREATE INDEX IF NOT EXISTS users_uid_text ON users (uid_text);
+
+-- Each pair once, with user1 < user2
 CREATE TABLE IF NOT EXISTS friends (
        user1 INTEGER REFERENCES users (uid),
        user2 INTEGER REFERENCES users (uid),
        PRIMARY KEY (user1, user2)
-);
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS friends_user2 ON friends (user2);
 
 CREATE TABLE IF NOT EXISTS follows (
        from_user INTEGER REFERENCES users (uid),
        to_user INTEGER REFERENCES users (uid),
        PRIMARY KEY (from_user, to_user)
-);
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS follows_to_user ON follows (to_user);
 
 CREATE TABLE IF NOT EXISTS tastes (
        uid INTEGER REFERENCES users (uid),
+       cat TEXT,
        tag TEXT,
        count INTEGER,
-       PRIMARY KEY (uid, tag)
-);
\ No newline at end of file
+       PRIMARY KEY (uid, cat, tag)
+);
+
+-- When each of a user's lists was last fetched from the API, and how
+-- many entries it had
+CREATE TABLE IF NOT EXISTS fetches (
+       uid INTEGER REFERENCES users (uid),
+       list TEXT,
+       fetched DATE,
+       size INTEGER,
+       PRIMARY KEY (uid, list)
+) WITHOUT ROWID;
+
+-- Users and edges per location, kept up to date by the triggers below.
+-- Location 0 stands for users with no location.
+CREATE TABLE IF NOT EXISTS location_users (
+       location_id INTEGER PRIMARY KEY,
+       users INTEGER
+);
+
+-- Friends once per pair of locations, with location1 <= location2
+CREATE TABLE IF NOT EXISTS location_edges (
+       kind TEXT, -- 'friends' or 'follows'
+       location1 INTEGER,
+       location2 INTEGER,
+       edges INTEGER,
+       PRIMARY KEY (kind, location1, location2)
+) WITHOUT ROWID;
+
+-- No OR REPLACE in these triggers: the INSERT OR IGNORE firing one
+-- would turn it into OR IGNORE too
+CREATE TRIGGER IF NOT EXISTS count_users AFTER INSERT ON users BEGIN
+       INSERT INTO location_users
+              SELECT coalesce(NEW.location_id, 0), 0 WHERE NOT EXISTS
+              (SELECT 1 FROM location_users
+               WHERE location_id = coalesce(NEW.location_id, 0));
+       UPDATE location_users SET users = users + 1
+              WHERE location_id = coalesce(NEW.location_id, 0);
+END;
+
+CREATE TRIGGER IF NOT EXISTS count_friends AFTER INSERT ON friends BEGIN
+       INSERT INTO location_edges
+              SELECT 'friends', min(l1, l2), max(l1, l2), 0
+              FROM (SELECT coalesce((SELECT location_id FROM users
+                                     WHERE uid = NEW.user1), 0) AS l1,
+                           coalesce((SELECT location_id FROM users
+                                     WHERE uid = NEW.user2), 0) AS l2)
+              WHERE NOT EXISTS
+              (SELECT 1 FROM location_edges WHERE kind = 'friends'
+               AND location1 = min(l1, l2) AND location2 = max(l1, l2));
+       UPDATE location_edges SET edges = edges + 1
+              WHERE kind = 'friends' AND location1 = (
+                    SELECT min(l1, l2) FROM (SELECT
+                    coalesce((SELECT location_id FROM users
+                              WHERE uid = NEW.user1), 0) AS l1,
+                    coalesce((SELECT location_id FROM users
+                              WHERE uid = NEW.user2), 0) AS l2))
+              AND location2 = (
+                    SELECT max(l1, l2) FROM (SELECT
+                    coalesce((SELECT location_id FROM users
+                              WHERE uid = NEW.user1), 0) AS l1,
+                    coalesce((SELECT location_id FROM users
+                              WHERE uid = NEW.user2), 0) AS l2));
+END;
+
+CREATE TRIGGER IF NOT EXISTS count_follows AFTER INSERT ON follows BEGIN
+       INSERT INTO location_edges
+              SELECT 'follows', l1, l2, 0
+              FROM (SELECT coalesce((SELECT location_id FROM users
+                                     WHERE uid = NEW.from_user), 0) AS l1,
+                           coalesce((SELECT location_id FROM users
+                                     WHERE uid = NEW.to_user), 0) AS l2)
+              WHERE NOT EXISTS
+              (SELECT 1 FROM location_edges WHERE kind = 'follows'
+               AND location1 = l1 AND location2 = l2);
+       UPDATE location_edges SET edges = edges + 1
+              WHERE kind = 'follows'
+              AND location1 = coalesce((SELECT location_id FROM users
+                                        WHERE uid = NEW.from_user), 0)
+              AND location2 = coalesce((SELECT location_id FROM users
+                                        WHERE uid = NEW.to_user), 0);
+END;
+
+-- Every user and edge inserted, in order, see changelog.py.
+-- AUTOINCREMENT so that a sequence number is never used twice, even
+-- once the log is trimmed to nothing
+CREATE TABLE IF NOT EXISTS changes (
+       seq INTEGER PRIMARY KEY AUTOINCREMENT,
+       kind INTEGER, -- 0 users (a = uid), 1 friends, 2 follows (a, b)
+       a INTEGER,
+       b INTEGER
+);
+
+-- How far each incremental job has read the changes
+CREATE TABLE IF NOT EXISTS change_offsets (
+       consumer TEXT PRIMARY KEY,
+       seq INTEGER
+);
+
+CREATE TRIGGER IF NOT EXISTS log_users AFTER INSERT ON users BEGIN
+       INSERT INTO changes (kind, a) VALUES (0, NEW.uid);
+END;
+
+CREATE TRIGGER IF NOT EXISTS log_friends AFTER INSERT ON friends BEGIN
+       INSERT INTO changes (kind, a, b) VALUES (1, NEW.user1, NEW.user2);
+END;
+
+CREATE TRIGGER IF NOT EXISTS log_follows AFTER INSERT ON follows BEGIN
+       INSERT INTO changes (kind, a, b) VALUES (2, NEW.from_user,
+                                                NEW.to_user);
+END;
@@ -0,0 +1,99 @@
+#
+# Decode API responses into database rows in worker processes
+# author: Wu Zhe <wu@madk.org>
+#
+
+import time, signal, re, multiprocessing
+import douban
+
+DECODE_TIMEOUT = 60 # seconds to wait for a worker, also lets ^C through
+
+# Map fields in `users' table to douban_python gdata api methods
+MAPPER = (('uid', lambda x: int(x.GetSelfLink().href.split('/')[-1])),
+          ('uid_text', lambda x: x.uid.text),
+          ('location', lambda x: x.location.text),
+          ('nickname', lambda x: x.title.text),
+          ('icon_url', lambda x: x.link[2].href),
+          ('homepage', lambda x: x.link[3].href),
+          ('description', lambda x: x.content.text))
+
+ENTRY_RE = re.compile(r'<(?:\w+:)?entry[\s>/]')
+
+def map_entry(entry):
+    """Extract a `users' row from a PeopleEntry, see MAPPER."""
+    fields = []
+    for field, getter in MAPPER:
+        try:
+            fields.append(getter(entry))
+        except (AttributeError, IndexError):
+            fields.append(None)
+    return fields
+
+def count_entries(text):
+    """Number of entries in a feed, without decoding it."""
+    return len(ENTRY_RE.findall(text))
+
+def _people(text):
+    return map_entry(douban.PeopleEntryFromString(text))
+
+def _people_feed(text):
+    return [map_entry(e) for e in douban.PeopleFeedFromString(text).entry]
+
+def _tag_feed(text):
+    return [(e.title.text, int(e.count.text))
+            for e in douban.TagFeedFromString(text).entry]
+
+# What each kind of response decodes to: a users row, a list of users
+# rows, or a list of (tag, count)
+DECODERS = {'people': _people,
+            'friends': _people_feed,
+            'tags': _tag_feed}
+
+def decode(what, text):
+    """The rows in text, and the seconds it took to decode them."""
+    begin = time.time()
+    rows = DECODERS[what](text)
+    return rows, time.time() - begin
+
+def _init_worker():
+    # ^C and timeouts are for the crawler, not the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGALRM, signal.SIG_IGN)
+
+class _Inline:
+    """Decodes when asked for the result, like a pool with no workers."""
+
+    def __init__(self, what, text):
+        self.what = what
+        self.text = text
+
+    def get(self, timeout=None):
+        return decode(self.what, self.text)
+
+class DecodePool:
+    """Decodes responses in `workers' processes, off the crawler's GIL.
+
+    submit() returns at once with something to get() the result of
+    decode() from, so the next request can go out while the previous
+    response decodes. With no workers responses are decoded in the
+    calling process instead.
+    """
+
+    def __init__(self, workers=None):
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.workers = workers
+        self.pool = None
+        if workers:
+            self.pool = multiprocessing.Pool(workers, _init_worker)
+
+    def submit(self, what, text):
+        if self.pool is None:
+            return _Inline(what, text)
+        return self.pool.apply_async(decode, (what, text))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
@@ -0,0 +1,202 @@
+#
+# Export the friends/follows graph as compressed sparse row arrays
+# author: Wu Zhe <wu@madk.org>
+#
+# Usage: python graph.py [DB_PATH [GRAPH_DIR]]
+#
+# GRAPH_DIR gets one set of flat native-endian arrays shared by all
+# graphs, and one pair per graph:
+#
+#   uids               int64, the uid of each dense node index, sorted
+#   NAME.offsets       int64, neighbours of node i are in [off[i], off[i+1])
+#   NAME.neighbours    int32, dense node indices
+#
+# `friends' is stored in both directions, `follows' from follower to
+# followee. load() maps the files read-only without copying them.
+#
+# `version' has the number of the latest change in the database when
+# it was exported, see changelog.py. refresh() exports again once the
+# database has changed since. An export is written to a new directory
+# next to GRAPH_DIR and renamed into place, so a reader never sees half
+# of one, and arrays mapped from the one before stay as they were. An
+# interrupted export leaves its directory behind.
+#
+
+import os, sys, sqlite3, tempfile, shutil
+import changelog
+
+try:
+    import numpy
+except ImportError:
+    raise ImportError('graph.py needs numpy, please install it first')
+
+DB_PATH = os.path.normpath('../data.db')
+GRAPH_DIR = os.path.normpath('../graph')
+
+UID_TYPE = numpy.int64
+OFFSET_TYPE = numpy.int64
+INDEX_TYPE = numpy.int32
+CHUNK_SIZE = 1000000 # edges read from sqlite at a time
+
+# name: (edge query, stored in both directions)
+GRAPHS = {'friends': ('SELECT user1, user2 FROM friends', True),
+          'follows': ('SELECT from_user, to_user FROM follows', False)}
+
+class Graph:
+    def __init__(self, uids, offsets, neighbours):
+        self.uids = uids
+        self.offsets = offsets
+        self.neighbours = neighbours
+        self.n = len(uids)
+        self.m = len(neighbours)
+
+    def index(self, uid):
+        i = numpy.searchsorted(self.uids, uid)
+        if i == self.n or self.uids[i] != uid:
+            raise KeyError(uid)
+        return i
+
+    def neighbours_of(self, i):
+        return self.neighbours[self.offsets[i]:self.offsets[i + 1]]
+
+    def out_degrees(self):
+        return numpy.diff(self.offsets)
+
+    def in_degrees(self):
+        return numpy.bincount(self.neighbours, minlength=self.n)
+
+def _read_uids(conn):
+    cursor = conn.cursor()
+    cursor.execute('SELECT uid FROM users UNION SELECT user1 FROM friends '
+                   'UNION SELECT user2 FROM friends '
+                   'UNION SELECT from_user FROM follows '
+                   'UNION SELECT to_user FROM follows ORDER BY 1')
+    chunks = [numpy.zeros(0, UID_TYPE)]
+    while True:
+        rows = cursor.fetchmany(CHUNK_SIZE)
+        if not rows: break
+        chunks.append(numpy.array(rows, UID_TYPE).ravel())
+    return numpy.concatenate(chunks)
+
+def _edge_chunks(conn, sql, uids, symmetric):
+    """Yield (src, dst) arrays of dense indices, CHUNK_SIZE edges each."""
+    cursor = conn.cursor()
+    cursor.execute(sql)
+    while True:
+        rows = cursor.fetchmany(CHUNK_SIZE)
+        if not rows: break
+        edges = numpy.searchsorted(uids, numpy.array(rows, UID_TYPE))
+        src = edges[:, 0].astype(INDEX_TYPE)
+        dst = edges[:, 1].astype(INDEX_TYPE)
+        if symmetric:
+            src, dst = numpy.concatenate((src, dst)), \
+                       numpy.concatenate((dst, src))
+        yield src, dst
+
+def _export_graph(conn, uids, sql, symmetric, path):
+    n = len(uids)
+    # First pass: count the degrees to lay out the rows
+    degrees = numpy.zeros(n, OFFSET_TYPE)
+    for src, dst in _edge_chunks(conn, sql, uids, symmetric):
+        degrees += numpy.bincount(src, minlength=n)
+    offsets = numpy.zeros(n + 1, OFFSET_TYPE)
+    numpy.cumsum(degrees, out=offsets[1:])
+    offsets.tofile(path + '.offsets')
+
+    m = int(offsets[-1])
+    if m == 0:
+        open(path + '.neighbours', 'wb').close()
+        return offsets
+    # Second pass: scatter each chunk into its rows, straight to disk
+    neighbours = numpy.memmap(path + '.neighbours', INDEX_TYPE, 'w+',
+                              shape=(m,))
+    fill = offsets[:-1].copy()
+    for src, dst in _edge_chunks(conn, sql, uids, symmetric):
+        order = numpy.argsort(src, kind='mergesort')
+        src = src[order]
+        rank = numpy.arange(len(src)) - numpy.searchsorted(src, src)
+        neighbours[fill[src] + rank] = dst[order]
+        fill += numpy.bincount(src, minlength=n)
+    neighbours.flush()
+    del neighbours
+    return offsets
+
+def export(conn, directory):
+    """Export the graphs into directory, replacing what is there.
+
+    Everything is read in one transaction, so a crawler writing
+    meanwhile cannot add edges between the passes over a table, or
+    edges to users read after the uids were.
+    """
+    parent = os.path.dirname(os.path.abspath(directory))
+    if not os.path.exists(parent):
+        os.makedirs(parent)
+    new = tempfile.mkdtemp(prefix=os.path.basename(directory) + '.',
+                           dir=parent)
+    os.chmod(new, 0755)
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None # we BEGIN and COMMIT ourselves
+    conn.execute("BEGIN")
+    try:
+        uids = _read_uids(conn)
+        uids.tofile(os.path.join(new, 'uids'))
+        for name, (sql, symmetric) in sorted(GRAPHS.items()):
+            offsets = _export_graph(conn, uids, sql, symmetric,
+                                    os.path.join(new, name))
+            print "%s: %d nodes, %d edges" % (name, len(uids), offsets[-1])
+        version = changelog.last(conn)
+    finally:
+        conn.execute("COMMIT")
+        conn.isolation_level = isolation_level
+    f = open(os.path.join(new, 'version'), 'w')
+    f.write('%d\n' % version)
+    f.close()
+    if os.path.exists(directory):
+        old = new + '.old'
+        os.rename(directory, old)
+        os.rename(new, directory)
+        shutil.rmtree(old)
+    else:
+        os.rename(new, directory)
+
+def exported_version(directory):
+    """The change the export in directory is up to, None if there is
+    no complete export."""
+    path = os.path.join(directory, 'version')
+    if not os.path.exists(path):
+        return None
+    f = open(path)
+    version = int(f.read())
+    f.close()
+    return version
+
+def refresh(conn, directory):
+    """Export into directory unless it is up to date with the
+    database. Returns whether it exported."""
+    if exported_version(directory) == changelog.last(conn):
+        return False
+    export(conn, directory)
+    return True
+
+def _map(path, dtype):
+    if os.path.getsize(path) == 0:
+        return numpy.zeros(0, dtype)
+    return numpy.memmap(path, dtype, 'r')
+
+def load(directory, name):
+    """Memory-map graph `name' as exported into `directory'."""
+    return Graph(_map(os.path.join(directory, 'uids'), UID_TYPE),
+                 _map(os.path.join(directory, name + '.offsets'),
+                      OFFSET_TYPE),
+                 _map(os.path.join(directory, name + '.neighbours'),
+                      INDEX_TYPE))
+
+def main():
+    db_path = len(sys.argv) > 1 and sys.argv[1] or DB_PATH
+    directory = len(sys.argv) > 2 and sys.argv[2] or GRAPH_DIR
+    conn = sqlite3.connect(db_path)
+    export(conn, directory)
+    conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#
+# Users and edges per location
+# author: Wu Zhe <wu@madk.org>
+#
+# Usage: python locations.py [DB_PATH [LOCATION]]
+#
+# Location names are kept once in `locations', users refer to them by
+# id. Triggers keep the number of users in each location, and of
+# friends and follows between each two, up to date as rows are
+# inserted, so per-city figures read a few hundred rows instead of
+# scanning users. Location 0 stands for users with no location.
+#
+
+import os, sys, sqlite3
+
+DB_PATH = os.path.normpath('../data.db')
+
+def count_all(conn):
+    """Fill the count tables from scratch, for databases that have
+    users and edges from before the triggers."""
+    conn.execute("DELETE FROM location_users")
+    conn.execute("DELETE FROM location_edges")
+    conn.execute("INSERT INTO location_users SELECT coalesce(location_id, "
+                 "0), count(*) FROM users GROUP BY 1")
+    conn.execute("INSERT INTO location_edges SELECT 'friends', min(l1, l2), "
+                 "max(l1, l2), count(*) FROM (SELECT coalesce(a.location_id, "
+                 "0) AS l1, coalesce(b.location_id, 0) AS l2 FROM friends "
+                 "LEFT JOIN users AS a ON a.uid = user1 LEFT JOIN users AS "
+                 "b ON b.uid = user2) GROUP BY 2, 3")
+    conn.execute("INSERT INTO location_edges SELECT 'follows', "
+                 "coalesce(a.location_id, 0), coalesce(b.location_id, 0), "
+                 "count(*) FROM follows LEFT JOIN users AS a ON a.uid = "
+                 "from_user LEFT JOIN users AS b ON b.uid = to_user "
+                 "GROUP BY 2, 3")
+
+def location_id(conn, name):
+    """The id of a location name, None if no user is there."""
+    row = conn.execute("SELECT id FROM locations WHERE name=?",
+                       (name,)).fetchone()
+    return row and row[0]
+
+def user_counts(conn, limit=None):
+    """(location name, users) by users, most first. None is the users
+    without a location."""
+    return conn.execute("SELECT name, users FROM location_users LEFT JOIN "
+                        "locations ON id = location_id ORDER BY users DESC "
+                        "LIMIT ?", (limit or -1,)).fetchall()
+
+def edge_counts(conn, kind='friends', location=None, limit=None):
+    """(location name, location name, edges) by edges, most first.
+
+    Friends are counted once per pair of users, follows from the first
+    location to the second. With `location' only the pairs it is in.
+    """
+    where = "kind = ?"
+    params = [kind]
+    if location is not None:
+        where += " AND (location1 = ? OR location2 = ?)"
+        params += [location_id(conn, location)] * 2
+    return conn.execute("SELECT l1.name, l2.name, edges FROM location_edges "
+                        "LEFT JOIN locations AS l1 ON l1.id = location1 "
+                        "LEFT JOIN locations AS l2 ON l2.id = location2 "
+                        "WHERE %s ORDER BY edges DESC LIMIT ?" % where,
+                        params + [limit or -1]).fetchall()
+
+def main():
+    db_path = len(sys.argv) > 1 and sys.argv[1] or DB_PATH
+    location = len(sys.argv) > 2 and sys.argv[2].decode('utf-8') or None
+    conn = sqlite3.connect(db_path, timeout=60)
+    if location is None:
+        for name, users in user_counts(conn, 20):
+            print (u"%8d  %s" % (users, name)).encode('utf-8')
+    for kind in ('friends', 'follows'):
+        print
+        print kind
+        for name1, name2, edges in edge_counts(conn, kind, location, 20):
+            print (u"%8d  %s - %s" % (edges, name1, name2)).encode('utf-8')
+    conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+#
+# Counters, gauges and histograms for watching a running crawl
+# author: Wu Zhe <wu@madk.org>
+#
+
+import os, time, threading, bisect, BaseHTTPServer
+
+# Upper bounds in seconds, from a fast sqlite write to a slow API call
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                   5.0, 10.0, 30.0)
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+class Gauge(Counter):
+    def set(self, value):
+        self.value = value
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        total = 0
+        for bound, n in zip(self.buckets + ('+Inf',), self.counts):
+            total += n
+            yield name + '_bucket', labels + (('le', str(bound)),), total
+        yield name + '_sum', labels, self.sum
+        yield name + '_count', labels, self.count
+
+class Family:
+    """A metric and its children, one per combination of label values."""
+
+    def __init__(self, kind, name, help, labelnames, factory):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.factory = factory
+        self.children = {}
+        if not labelnames:
+            self.children[()] = factory()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self.factory()
+        return child
+
+    # Shortcuts for metrics without labels
+    def inc(self, n=1):
+        self.children[()].inc(n)
+
+    def set(self, value):
+        self.children[()].set(value)
+
+    def observe(self, value):
+        self.children[()].observe(value)
+
+    def expose(self):
+        lines = ['# HELP %s %s' % (self.name, self.help),
+                 '# TYPE %s %s' % (self.name, self.kind)]
+        for values, child in sorted(self.children.items()):
+            labels = tuple(zip(self.labelnames, values))
+            for name, labels, value in child.samples(self.name, labels):
+                if labels:
+                    name += '{%s}' % ','.join(['%s="%s"' % l for l in labels])
+                lines.append('%s %s' % (name, repr(float(value))))
+        return '\n'.join(lines)
+
+class Registry:
+    """Metrics updated from the crawl thread and read from any other.
+
+    Updates take no lock: only one thread writes, and a reader seeing a
+    histogram half way through an observe() is off by one sample.
+    """
+
+    def __init__(self):
+        self.families = []
+
+    def _add(self, kind, name, help, labelnames, factory):
+        family = Family(kind, name, help, labelnames, factory)
+        self.families.append(family)
+        return family
+
+    def counter(self, name, help, labelnames=()):
+        return self._add('counter', name, help, labelnames, Counter)
+
+    def gauge(self, name, help, labelnames=()):
+        return self._add('gauge', name, help, labelnames, Gauge)
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add('histogram', name, help, labelnames,
+                         lambda: Histogram(buckets))
+
+    def expose(self):
+        """The registry in the plain text metrics exposition format."""
+        return '\n'.join([f.expose() for f in self.families]) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        """Answer GET /metrics on a local port from a daemon thread."""
+        registry = self
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.expose()
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, *args):
+                pass
+        server = BaseHTTPServer.HTTPServer((host, port), Handler)
+        _daemon(server.serve_forever)
+        return server
+
+    def snapshot(self, path):
+        tmp_path = path + '.tmp'
+        f = open(tmp_path, 'w')
+        f.write('# snapshot at %d\n' % time.time())
+        f.write(self.expose())
+        f.close()
+        os.rename(tmp_path, path) # readers never see a partial file
+
+    def snapshot_every(self, path, interval):
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.snapshot(path)
+        _daemon(loop)
+
+def _daemon(target):
+    t = threading.Thread(target=target)
+    t.setDaemon(True)
+    t.start()
+    return t
+
+# The crawler's metrics
+REGISTRY = Registry()
+REQUEST_SECONDS = REGISTRY.histogram(
+    'crawler_request_seconds', 'Douban API request time, decoding excluded',
+    ('endpoint',))
+REQUESTS = REGISTRY.counter(
+    'crawler_requests_total', 'Douban API requests by outcome',
+    ('endpoint', 'outcome'))
+PARSE_SECONDS = REGISTRY.histogram(
+    'crawler_parse_seconds', 'Atom XML parsing time', ('endpoint',))
+DB_WRITE_SECONDS = REGISTRY.histogram(
+    'crawler_db_write_seconds', 'Time to store one user and commit')
+RETRIES = REGISTRY.counter(
+    'crawler_retries_total', 'Requests retried after a timeout')
+BANS = REGISTRY.counter(
+    'crawler_bans_total', 'Times the API banned us')
+QUEUE_DEPTH = REGISTRY.gauge(
+    'crawler_queue_depth', 'Users waiting in the BFS queue')
+VISITED = REGISTRY.gauge(
+    'crawler_visited_users', 'Users visited so far')
+USERS_IN_DB = REGISTRY.gauge(
+    'crawler_users_in_db', 'Users stored in the database')
+ESTIMATED_USERS = REGISTRY.gauge(
+    'crawler_estimated_users', 'Estimated number of douban users')
+REQUEST_RATE = REGISTRY.gauge(
+    'crawler_request_rate', 'Request rate allowed by the rate controller, '
+    'per minute')
@@ -0,0 +1,295 @@
+#
+# Versioned upgrades of the crawler database
+# author: Wu Zhe <wu@madk.org>
+#
+# Usage: python migrate.py [DB_PATH]
+#
+# The schema version lives in PRAGMA user_version. db.sql always holds
+# the latest schema and version, so only databases created before a
+# migration need it. Migrations copy big tables in chunks, one
+# transaction each, so that no transaction grows with the table.
+#
+# Upgrades are offline: stop the crawler and the other tools first. A
+# crawler of an older version would write rows of the old schema into
+# half-migrated tables, so migrate.py holds an exclusive lock for the
+# whole run, and refuses to start while anything else has the database
+# open in WAL mode.
+#
+
+import os, sys, re, sqlite3, time
+import compact, locations
+
+DB_PATH = os.path.normpath('../data.db')
+SQL_PATH = os.path.normpath('db.sql')
+CHUNK_SIZE = 200000 # rows copied per transaction
+
+CREATE_RE = re.compile(r'CREATE (?:TABLE|INDEX|TRIGGER) IF NOT EXISTS (\w+)')
+
+class MigrationError(Exception): pass
+
+def schema(path=SQL_PATH):
+    """The statements of db.sql, by the name of the table, index or
+    trigger they create. Migrations take their tables from there, so
+    each is only written down once."""
+    statements = {}
+    statement = ''
+    for line in open(path):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            match = CREATE_RE.search(statement)
+            if match:
+                statements[match.group(1)] = statement.strip()
+            statement = ''
+    return statements
+
+def create(conn, *names):
+    """Create the tables, indexes and triggers of db.sql called names,
+    in that order, unless they exist."""
+    statements = schema()
+    for name in names:
+        conn.execute(statements[name])
+
+def rebuild_table(conn, table, select_sql=None):
+    """Copy `table' into a new table as db.sql has it, then swap the
+    two.
+
+    Rows are copied in rowid order, CHUNK_SIZE at a time, then the old
+    table is dropped and the new one renamed in a last transaction.
+    `select_sql' % name can transform the rows on the way.
+    """
+    new = table + '_new'
+    select_sql = select_sql or 'SELECT * FROM %s'
+    cursor = conn.cursor()
+    cursor.execute("DROP TABLE IF EXISTS %s" % new) # an interrupted run
+    cursor.execute(schema()[table].replace(
+        'CREATE TABLE IF NOT EXISTS %s ' % table, 'CREATE TABLE %s ' % new, 1))
+    last = 0
+    while True:
+        cursor.execute("SELECT max(rowid) FROM (SELECT rowid FROM %s "
+                       "WHERE rowid > ? ORDER BY rowid LIMIT ?)" % table,
+                       (last, CHUNK_SIZE))
+        upto = cursor.fetchone()[0]
+        if upto is None: break
+        cursor.execute("BEGIN")
+        cursor.execute("INSERT OR IGNORE INTO %s " % new + select_sql % table +
+                       " WHERE rowid > ? AND rowid <= ?", (last, upto))
+        cursor.execute("COMMIT")
+        last = upto
+        print "  %s: copied up to row %d" % (table, last)
+    cursor.execute("BEGIN")
+    cursor.execute("DROP TABLE %s" % table)
+    cursor.execute("ALTER TABLE %s RENAME TO %s" % (new, table))
+    cursor.execute("COMMIT")
+
+def edges_without_rowid(conn):
+    for table in ('follows', 'friends'):
+        rebuild_table(conn, table)
+
+def lookup_indexes(conn):
+    create(conn, 'friends_user2', 'follows_to_user', 'users_uid_text')
+
+def chunk_bounds(conn, table, key):
+    """Yield (low, high] ranges of `key' covering about CHUNK_SIZE
+    rows each, for tables clustered by `key'."""
+    last = None
+    while True:
+        if last is None:
+            row = conn.execute("SELECT max(%s) FROM (SELECT %s FROM %s "
+                               "ORDER BY %s LIMIT ?)" % (key, key, table, key),
+                               (CHUNK_SIZE,)).fetchone()
+        else:
+            row = conn.execute("SELECT max(%s) FROM (SELECT %s FROM %s "
+                               "WHERE %s > ? ORDER BY %s LIMIT ?)" %
+                               (key, key, table, key, key),
+                               (last, CHUNK_SIZE)).fetchone()
+        if row[0] is None: break
+        yield last, row[0]
+        last = row[0]
+
+def canonical_friends(conn):
+    """Store each friend pair once, as (min, max), in place.
+
+    Until now a visit stored (self, friend) unless the reverse was
+    there, so user1 = uid also told that uid's own friend list had been
+    fetched. That goes into `fetches' first, one chunk at a time.
+    """
+    create(conn, 'fetches')
+    for low, high in chunk_bounds(conn, 'friends', 'user1'):
+        if low is None:
+            where = "user1 <= %d" % high
+        else:
+            where = "user1 > %d AND user1 <= %d" % (low, high)
+        conn.execute("BEGIN")
+        conn.execute("INSERT OR IGNORE INTO fetches SELECT user1, 'friends', "
+                     "NULL, count(*) FROM friends WHERE %s GROUP BY user1" %
+                     where)
+        conn.execute("INSERT OR IGNORE INTO friends SELECT user2, user1 "
+                     "FROM friends WHERE user1 > user2 AND %s" % where)
+        conn.execute("DELETE FROM friends WHERE user1 > user2 AND %s" % where)
+        conn.execute("COMMIT")
+        print "  friends: canonical up to user %d" % high
+
+def backfill_contacts(conn):
+    """Users with follows stored had their contact list fetched."""
+    for low, high in chunk_bounds(conn, 'follows', 'from_user'):
+        where = "from_user <= %d" % high
+        if low is not None:
+            where += " AND from_user > %d" % low
+        conn.execute("BEGIN")
+        conn.execute("INSERT OR IGNORE INTO fetches SELECT from_user, "
+                     "'contacts', NULL, count(*) FROM follows WHERE %s "
+                     "GROUP BY from_user" % where)
+        conn.execute("COMMIT")
+
+def pack_users(conn):
+    """Pack descriptions and URLs of users, see compact.py.
+
+    The dictionary is trained on a sample of the descriptions first.
+    Rows packed already unpack to themselves, so an interrupted run can
+    simply start over. The file only shrinks after a VACUUM.
+    """
+    create(conn, 'dictionaries')
+    codec = compact.Codec(conn)
+    samples = []
+    if codec.current is None:
+        samples = [codec.unpack_description(x[0]) for x in conn.execute(
+            "SELECT description FROM users WHERE description != '' "
+            "ORDER BY random() LIMIT ?", (compact.TRAIN_SAMPLES,))]
+    if samples:
+        conn.execute("BEGIN")
+        codec.add_dictionary(compact.train([x.encode('utf-8')
+                                            for x in samples]))
+        conn.execute("COMMIT")
+    for low, high in chunk_bounds(conn, 'users', 'uid'):
+        where = "uid <= %d" % high
+        if low is not None:
+            where += " AND uid > %d" % low
+        conn.execute("BEGIN")
+        rows = conn.execute("SELECT uid, uid_text, icon_url, homepage, "
+                            "description FROM users WHERE %s" %
+                            where).fetchall()
+        packed = []
+        for uid, uid_text, icon_url, homepage, description in rows:
+            packed.append((
+                compact.pack_url(compact.unpack_url(icon_url, uid, uid_text),
+                                 uid, uid_text),
+                compact.pack_url(compact.unpack_url(homepage, uid, uid_text),
+                                 uid, uid_text),
+                codec.pack_description(codec.unpack_description(description)),
+                uid))
+        conn.executemany("UPDATE users SET icon_url=?, homepage=?, "
+                         "description=? WHERE uid=?", packed)
+        conn.execute("COMMIT")
+        print "  users: packed up to user %d" % high
+
+def normalise_locations(conn):
+    """Refer to locations by id, and count users and edges per location.
+
+    The counts are taken and the triggers that keep them up to date
+    created in one transaction.
+    """
+    create(conn, 'locations', 'location_users', 'location_edges')
+    conn.execute("BEGIN")
+    conn.execute("INSERT OR IGNORE INTO locations (name) SELECT DISTINCT "
+                 "location FROM users WHERE location != ''")
+    conn.execute("COMMIT")
+    rebuild_table(conn, 'users',
+                  "SELECT uid, uid_text, (SELECT id FROM locations WHERE "
+                  "name = location), nickname, icon_url, homepage, "
+                  "description, created FROM %s")
+    create(conn, 'users_uid_text')
+    conn.execute("BEGIN")
+    locations.count_all(conn)
+    create(conn, 'count_users', 'count_friends', 'count_follows')
+    conn.execute("COMMIT")
+
+def log_changes(conn):
+    """Log users and edges inserted from now on, see changelog.py.
+
+    What is stored already is not logged, jobs read it whole once.
+    """
+    create(conn, 'changes', 'change_offsets')
+    conn.execute("BEGIN")
+    create(conn, 'log_users', 'log_friends', 'log_follows')
+    conn.execute("COMMIT")
+
+def tastes_categories(conn):
+    """Recreate `tastes' with the `cat' column, if it has none.
+
+    Nothing ever wrote to the table without it, so no rows are lost.
+    """
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(tastes)")]
+    conn.execute("BEGIN")
+    if 'cat' not in columns:
+        conn.execute("DROP TABLE IF EXISTS tastes")
+    create(conn, 'tastes')
+    conn.execute("COMMIT")
+
+# (version, description, upgrade function), oldest first
+MIGRATIONS = [
+    (1, 'cluster friends and follows by their keys (WITHOUT ROWID)',
+     edges_without_rowid),
+    (2, 'index reverse edges and users.uid_text', lookup_indexes),
+    (3, 'store friend pairs once, as (min, max)', canonical_friends),
+    (4, 'record fetched contact lists in fetches', backfill_contacts),
+    (5, 'pack users descriptions and URLs', pack_users),
+    (6, 'store locations by id, with per-location counts',
+     normalise_locations),
+    (7, 'log users and edges inserted', log_changes),
+    (8, 'add categories to tastes', tastes_categories)]
+LATEST = MIGRATIONS[-1][0]
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def lock(conn):
+    """Keep everyone else out of the database until conn is closed.
+
+    In WAL mode the exclusive lock is only granted while no other
+    connection has the database open, even an idle one.
+    """
+    conn.execute("PRAGMA locking_mode = EXCLUSIVE")
+    try:
+        conn.execute("BEGIN EXCLUSIVE")
+        conn.execute("COMMIT")
+    except sqlite3.OperationalError:
+        conn.execute("PRAGMA locking_mode = NORMAL")
+        raise MigrationError("the database is in use, stop the crawler "
+                             "and the other tools using it first")
+
+def migrate(conn):
+    """Bring the database up to LATEST, returns the versions applied.
+
+    Raises MigrationError if another connection has the database open.
+    """
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None # we BEGIN and COMMIT ourselves
+    applied = []
+    try:
+        if schema_version(conn) < LATEST:
+            lock(conn)
+        for version, description, upgrade in MIGRATIONS:
+            if version <= schema_version(conn): continue
+            print "Migrating to version %d: %s" % (version, description)
+            begin = time.time()
+            upgrade(conn)
+            conn.execute("PRAGMA user_version = %d" % version)
+            applied.append(version)
+            print "  done in %.1f seconds" % (time.time() - begin)
+    finally:
+        conn.isolation_level = isolation_level
+    return applied
+
+def main():
+    db_path = len(sys.argv) > 1 and sys.argv[1] or DB_PATH
+    conn = sqlite3.connect(db_path, timeout=60)
+    try:
+        if not migrate(conn):
+            print "%s is up to date (version %d)" % (db_path, LATEST)
+    except MigrationError, e:
+        print "%s: %s" % (db_path, e)
+        sys.exit(1)
+    conn.close()
+
+if __name__ == "__main__":
+    main()
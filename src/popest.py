@@ -0,0 +1,68 @@
+#
+# Online estimate of the number of douban users
+# author: Wu Zhe <wu@madk.org>
+#
+
+import math, random
+
+UID_BASE = 1000000 # douban numbers its users from 1000001 upwards
+
+class PopulationEstimator:
+    """Estimates the user population from the uids we come across.
+
+    Uids are handed out in sequence, so the population is the size of
+    the uid range times the share of uids in it that still exist. The
+    range is estimated from the largest uid seen (the German tank
+    estimator), the share from probing uniformly random uids in the
+    range. Every update is O(1).
+    """
+
+    def __init__(self, uid_base=UID_BASE, z=1.96):
+        self.uid_base = uid_base
+        self.z = z # 1.96 for a 95% confidence interval
+        self.known = 0 # distinct existing uids seen
+        self.max_offset = 0
+        self.probes = 0
+        self.hits = 0
+
+    def add(self, uid):
+        """Count a newly discovered, existing uid."""
+        self.known += 1
+        self.max_offset = max(self.max_offset, uid - self.uid_base)
+
+    def probe_uid(self):
+        return self.uid_base + random.randint(1, max(1, self.max_offset))
+
+    def add_probe(self, exists):
+        self.probes += 1
+        if exists:
+            self.hits += 1
+
+    def uid_range(self):
+        if not self.known:
+            return 0
+        return self.max_offset + float(self.max_offset) / self.known
+
+    def share(self):
+        """Share of existing uids in the range and its Wilson interval."""
+        n = self.probes
+        if not n:
+            return 1.0, 0.0, 1.0
+        p = float(self.hits) / n
+        z2 = self.z * self.z
+        center = (p + z2 / (2 * n)) / (1 + z2 / n)
+        spread = self.z * math.sqrt(p * (1 - p) / n + z2 / (4 * n * n)) / \
+                 (1 + z2 / n)
+        return p, center - spread, center + spread
+
+    def estimate(self):
+        """(estimate, low, high) of the number of users.
+
+        Never below the users already known; without probes the whole
+        uid range is the estimate.
+        """
+        size = self.uid_range()
+        p, low, high = self.share()
+        return (int(max(self.known, size * p)),
+                int(max(self.known, size * low)),
+                int(max(self.known, size * high)))
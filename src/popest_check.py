@@ -0,0 +1,62 @@
+#
+# Checks of the population estimate of popest.py
+# author: Wu Zhe <wu@madk.org>
+#
+# Usage: python popest_check.py
+#
+# A synthetic population of uids, a share of them deleted, is crawled
+# in random order and probed; the estimate must bracket its size.
+#
+
+import sys, random
+import popest
+
+failures = []
+
+def check(cond, message):
+    if not cond:
+        failures.append(message)
+        print "  FAIL:", message
+
+def check_empty():
+    est = popest.PopulationEstimator()
+    check(est.estimate() == (0, 0, 0), 'nothing seen')
+    est.add(popest.UID_BASE + 10)
+    check(est.estimate() == (20, 1, 20), 'whole range without probes')
+    check(est.probe_uid() - popest.UID_BASE in range(1, 11), 'probe in range')
+
+def check_estimate():
+    random.seed(1)
+    size, share = 100000, 0.7
+    exists = set([uid for uid in xrange(popest.UID_BASE + 1,
+                                        popest.UID_BASE + size + 1)
+                  if random.random() < share])
+    est = popest.PopulationEstimator()
+    for uid in random.sample(sorted(exists), 2000):
+        est.add(uid)
+    for i in xrange(3000):
+        est.add_probe(est.probe_uid() in exists)
+    estimate, low, high = est.estimate()
+    check(low <= len(exists) <= high, 'interval holds the population')
+    check(abs(estimate - len(exists)) < 0.05 * len(exists), 'estimate close')
+    check(low < estimate < high, 'estimate inside its interval')
+    for i in xrange(3000):
+        est.add_probe(est.probe_uid() in exists)
+    check(est.estimate()[2] - est.estimate()[1] < high - low,
+          'interval narrows with probes')
+    est = popest.PopulationEstimator()
+    for uid in range(popest.UID_BASE + 1, popest.UID_BASE + 101):
+        est.add(uid)
+    est.add_probe(False)
+    check(est.estimate()[1] >= 100, 'never below the users known')
+
+def main():
+    for test in (check_empty, check_estimate):
+        test()
+    if failures:
+        print "%d checks failed" % len(failures)
+        sys.exit(1)
+    print "All checks passed"
+
+if __name__ == "__main__":
+    main()
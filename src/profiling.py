@@ -0,0 +1,91 @@
+#
+# Per-phase timing of the crawl, and an opt-in sampling profiler
+# author: Wu Zhe <wu@madk.org>
+#
+
+import os, sys, time, signal, cProfile, pstats
+
+# Phases of visiting one user, in the order they usually happen
+SPAN_NAMES = ('sleep', 'fetch', 'decode', 'query', 'store', 'commit')
+
+class Profiler:
+    """Adds up wall time per span for the user being visited.
+
+    Off by default, when add() costs one attribute lookup. Once started
+    it writes one line of span times per visited user, takes a stack
+    sample every `interval' seconds of CPU time for a collapsed-stack
+    dump, and runs cProfile on one user in every `sample_every'.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.spans = {}
+        self.stacks = {}
+        self.visits = 0
+        self.profile = None
+        self.user_profile = None
+
+    def add(self, name, seconds):
+        if self.enabled:
+            self.spans[name] = self.spans.get(name, 0) + seconds
+
+    def start(self, path, interval=0.005, sample_every=20):
+        """Write profile files to path + '.spans', '.stacks' and '.pstats'."""
+        self.enabled = True
+        self.path = path
+        self.sample_every = sample_every
+        self.spans_file = open(path + '.spans', 'w')
+        self.spans_file.write('\t'.join(('uid', 'total') + SPAN_NAMES +
+                                        ('other',)) + '\n')
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.siginterrupt(signal.SIGPROF, False) # don't break socket I/O
+        signal.setitimer(signal.ITIMER_PROF, interval, interval)
+
+    def begin_user(self):
+        if not self.enabled: return
+        self.spans = {}
+        self.visits += 1
+        if (self.visits - 1) % self.sample_every == 0:
+            self.user_profile = cProfile.Profile()
+            self.user_profile.enable()
+
+    def end_user(self, uid, total):
+        if not self.enabled: return
+        if self.user_profile:
+            self.user_profile.disable()
+            if self.profile is None:
+                self.profile = pstats.Stats(self.user_profile)
+            else:
+                self.profile.add(self.user_profile)
+            self.user_profile = None
+        times = [self.spans.get(name, 0) for name in SPAN_NAMES]
+        times.append(total - sum(times))
+        self.spans_file.write('\t'.join([str(uid), '%.4f' % total] +
+                                        ['%.4f' % t for t in times]) + '\n')
+        self.spans_file.flush()
+
+    def stop(self):
+        if not self.enabled: return
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        self.enabled = False
+        self.spans_file.close()
+        # One line per distinct stack, as flamegraph.pl expects
+        f = open(self.path + '.stacks', 'w')
+        for stack, count in sorted(self.stacks.items()):
+            f.write('%s %d\n' % (stack, count))
+        f.close()
+        if self.profile is not None:
+            self.profile.dump_stats(self.path + '.pstats')
+
+    def _sample(self, signum, frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append('%s:%s' % (os.path.basename(code.co_filename),
+                                    code.co_name))
+            frame = frame.f_back
+        names.reverse()
+        stack = ';'.join(names)
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+PROFILER = Profiler()
@@ -0,0 +1,135 @@
+#
+# Rank users by influence on the follows graph
+# author: Wu Zhe <wu@madk.org>
+#
+# Usage: python rank.py [DB_PATH [GRAPH_DIR]]
+#
+# Runs PageRank on the follows arrays from graph.py, exported again if
+# the database changed since, starting from the scores of the previous
+# run when there is one. The scores are kept in SCORES_PATH.*, out of
+# GRAPH_DIR, so they outlive the exports. The top users by PageRank and
+# by number of followers go in the `rankings' table.
+#
+
+import os, sys, sqlite3, time
+
+import graph, numpy # graph tells to install numpy if it is missing
+
+SCORES_PATH = os.path.normpath('../pagerank') # .uids and .scores
+DAMPING = 0.85
+TOLERANCE = 1e-8 # stop when the scores move less than this, in L1
+MAX_ITERATIONS = 200
+TOP_K = 1000
+
+RANKINGS_SQL = """
+CREATE TABLE IF NOT EXISTS rankings (
+       method TEXT,
+       rank INTEGER,
+       uid INTEGER REFERENCES users (uid),
+       score REAL,
+       computed DATE,
+       PRIMARY KEY (method, rank)
+);
+"""
+
+def pagerank(g, start=None, damping=DAMPING, tolerance=TOLERANCE,
+             max_iterations=MAX_ITERATIONS):
+    """Power iteration, returns (scores, iterations used, whether the
+    scores converged before max_iterations).
+
+    Each iteration is one sparse matrix-vector product over the CSR
+    arrays: every node spreads its score evenly over the users it
+    follows, and users following nobody spread theirs over everyone.
+    """
+    n = g.n
+    if n == 0:
+        return numpy.zeros(0), 0, True
+    out_degrees = g.out_degrees()
+    src = numpy.repeat(numpy.arange(n, dtype=graph.INDEX_TYPE), out_degrees)
+    dst = numpy.asarray(g.neighbours)
+    dangling = out_degrees == 0
+    inv_degrees = numpy.zeros(n)
+    inv_degrees[~dangling] = 1.0 / out_degrees[~dangling]
+
+    if start is None:
+        scores = numpy.ones(n) / n
+    else:
+        scores = start / start.sum()
+    converged = False
+    for i in xrange(1, max_iterations + 1):
+        spread = numpy.bincount(dst, weights=(scores * inv_degrees)[src],
+                                minlength=n)
+        leaked = scores[dangling].sum()
+        new = damping * spread + (damping * leaked + 1.0 - damping) / n
+        delta = numpy.abs(new - scores).sum()
+        scores = new
+        if delta < tolerance:
+            converged = True
+            break
+    return scores, i, converged
+
+def warm_start(uids, path):
+    """Last run's scores mapped onto today's nodes, or None.
+
+    Users new since then start from the average score.
+    """
+    if not os.path.exists(path + '.scores'):
+        return None
+    old_uids = numpy.fromfile(path + '.uids', graph.UID_TYPE)
+    old_scores = numpy.fromfile(path + '.scores', numpy.float64)
+    if not len(old_uids):
+        return None
+    start = numpy.ones(len(uids)) * old_scores.mean()
+    pos = numpy.minimum(numpy.searchsorted(old_uids, uids),
+                        len(old_uids) - 1)
+    known = old_uids[pos] == uids
+    start[known] = old_scores[pos[known]]
+    return start
+
+def save_scores(uids, scores, path):
+    numpy.asarray(uids).tofile(path + '.uids')
+    scores.tofile(path + '.scores')
+
+def top(uids, scores, k):
+    """(rank, uid, score) of the k best scores, best first."""
+    k = min(k, len(scores))
+    if k == 0:
+        return []
+    best = numpy.argpartition(-scores, k - 1)[:k]
+    best = best[numpy.argsort(-scores[best], kind='mergesort')]
+    return zip(range(1, k + 1), numpy.asarray(uids)[best].tolist(),
+               scores[best].tolist())
+
+def store(conn, method, ranking):
+    cursor = conn.cursor()
+    cursor.executescript(RANKINGS_SQL)
+    cursor.execute("DELETE FROM rankings WHERE method=?", (method,))
+    cursor.executemany("INSERT INTO rankings VALUES " +
+                       "(?,?,?,?,DATETIME('NOW'))",
+                       [(method,) + row for row in ranking])
+    conn.commit()
+
+def main():
+    db_path = len(sys.argv) > 1 and sys.argv[1] or graph.DB_PATH
+    directory = len(sys.argv) > 2 and sys.argv[2] or graph.GRAPH_DIR
+    conn = sqlite3.connect(db_path)
+    graph.refresh(conn, directory)
+    begin = time.time()
+    follows = graph.load(directory, 'follows')
+    start = warm_start(follows.uids, SCORES_PATH)
+    scores, iterations, converged = pagerank(follows, start)
+    save_scores(follows.uids, scores, SCORES_PATH)
+    store(conn, 'pagerank', top(follows.uids, scores, TOP_K))
+    store(conn, 'followers', top(follows.uids,
+                                 follows.in_degrees().astype(numpy.float64),
+                                 TOP_K))
+    conn.close()
+    if converged:
+        print "PageRank converged in %d iterations, %.1f seconds" % \
+              (iterations, time.time() - begin)
+    else:
+        print "PageRank did not converge in %d iterations (%.1f seconds), " \
+              "ranked the scores so far" % (iterations, time.time() - begin)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#
+# Adaptive request rate control for the crawler
+# author: Wu Zhe <wu@madk.org>
+#
+
+import random, time
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+class RateController:
+    """Additive-increase/multiplicative-decrease control of the request
+    rate, with capped jittered backoff and a circuit breaker for bans.
+
+    Rates are in requests per minute, never above 60/min_interval (the
+    API TOS limit). Before each request wait delay() seconds and call
+    start(), then report the outcome with success(), failure() or
+    banned().
+    """
+
+    def __init__(self, min_interval, max_interval=30.0, increase=0.5,
+                 decrease=0.5, slow_latency=5.0, backoff_init=2.0,
+                 backoff_max=300.0, ban_wait=3600 + 5, probe_wait=600.0,
+                 max_failures=5):
+        self.max_rate = min_interval and 60.0 / min_interval or None
+        self.min_rate = 60.0 / max_interval
+        self.increase = increase # reqs/min gained per good request
+        self.decrease = decrease # rate factor on slow or failed requests
+        self.slow_latency = slow_latency
+        self.backoff_init = backoff_init
+        self.backoff_max = backoff_max
+        self.ban_wait = ban_wait # douban removes a ban after 1 hour
+        self.probe_wait = probe_wait
+        self.max_failures = max_failures
+
+        self.rate = self.max_rate
+        self.ceiling = self.max_rate # lowered each time we get banned
+        self.state = CLOSED
+        self.failures = 0 # consecutive failures
+        self.next_time = 0 # earliest start of the next request
+
+    def interval(self):
+        return self.rate and 60.0 / self.rate or 0
+
+    def delay(self):
+        """Seconds to wait before the next request may be sent."""
+        return max(0, self.next_time - time.time())
+
+    def start(self):
+        if self.state == OPEN:
+            self.state = HALF_OPEN # the breaker lets one probe through
+
+    def success(self, latency):
+        self.state = CLOSED
+        self.failures = 0
+        if self.max_rate:
+            if latency > self.slow_latency:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+            else:
+                self.ceiling = min(self.max_rate,
+                                   self.ceiling + self.increase / 10)
+                self.rate = min(self.ceiling, self.rate + self.increase)
+        self.next_time = time.time() + self.interval()
+
+    def failure(self):
+        """A timeout or connection error: slow down and back off."""
+        self.failures += 1
+        if self.max_rate:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+        if self.state == HALF_OPEN or self.failures >= self.max_failures:
+            self._trip(self.probe_wait)
+        else:
+            backoff = min(self.backoff_max,
+                          self.backoff_init * 2 ** (self.failures - 1))
+            self.next_time = time.time() + self._jitter(backoff)
+
+    def banned(self):
+        """The API refused us: open the breaker until the ban is over."""
+        if self.state == HALF_OPEN:
+            # Still banned when probing, try again a bit later
+            self._trip(self.probe_wait)
+            return
+        if self.max_rate:
+            # Remember we were too fast, come back below that rate
+            self.ceiling = max(self.min_rate, self.rate * 0.9)
+            self.rate = max(self.min_rate, self.ceiling * self.decrease)
+        self._trip(self.ban_wait)
+
+    def _trip(self, wait):
+        self.state = OPEN
+        self.next_time = time.time() + wait + self._jitter(wait) * 0.1
+
+    def _jitter(self, seconds):
+        return seconds * random.uniform(0.5, 1.0)
@@ -0,0 +1,97 @@
+#
+# Checks of the rate control and circuit breaker of ratecontrol.py
+# author: Wu Zhe <wu@madk.org>
+#
+# Usage: python ratecontrol_check.py
+#
+# No request is sent and nothing waits: the checks only follow the
+# state, rate and delay() of a RateController.
+#
+
+import sys
+import ratecontrol
+from ratecontrol import CLOSED, OPEN, HALF_OPEN
+
+failures = []
+
+def check(cond, message):
+    if not cond:
+        failures.append(message)
+        print "  FAIL:", message
+
+def controller():
+    return ratecontrol.RateController(2, ban_wait=1000, probe_wait=100,
+                                      max_failures=3)
+
+def check_breaker():
+    rc = controller()
+    rc.start()
+    check(rc.state == CLOSED and rc.delay() == 0, 'closed at first')
+    rc.banned()
+    check(rc.state == OPEN, 'ban opens')
+    check(1000 <= rc.delay() <= 1100, 'open for the ban')
+    rc.start()
+    check(rc.state == HALF_OPEN, 'one probe lets through')
+    rc.banned()
+    check(rc.state == OPEN and 100 <= rc.delay() <= 110,
+          'ban while probing opens for a probe wait')
+    rc.start()
+    rc.failure()
+    check(rc.state == OPEN and 100 <= rc.delay() <= 110,
+          'failure while probing opens')
+    rc.start()
+    rc.success(0.1)
+    check(rc.state == CLOSED and rc.failures == 0, 'good probe closes')
+    check(rc.delay() <= rc.interval(), 'closed paces at the rate')
+
+def check_failures():
+    rc = controller()
+    for i in xrange(rc.max_failures - 1):
+        rc.start()
+        rc.failure()
+        check(rc.state == CLOSED, 'failure %d backs off' % (i + 1))
+    check(rc.delay() <= rc.backoff_init * 2 ** (rc.max_failures - 2),
+          'backoff capped by its doubling')
+    rc.start()
+    rc.failure()
+    check(rc.state == OPEN and rc.delay() >= rc.probe_wait,
+          'max_failures failures open')
+
+def check_rate():
+    rc = controller()
+    check(rc.rate == rc.max_rate == 30, 'starts at the TOS limit')
+    for i in xrange(20):
+        rc.success(0.1)
+    check(rc.rate == rc.max_rate, 'never above the TOS limit')
+    rc.success(rc.slow_latency + 1)
+    check(rc.rate == rc.max_rate * rc.decrease, 'slow response slows down')
+    rc.failure()
+    check(rc.rate == rc.max_rate * rc.decrease ** 2, 'failure slows down')
+    for i in xrange(20):
+        rc.failure()
+    check(rc.rate == rc.min_rate, 'never below the minimum rate')
+    rc = controller()
+    rc.banned()
+    ceiling = rc.ceiling
+    check(ceiling < rc.max_rate and rc.rate < ceiling,
+          'ban lowers the ceiling')
+    rc.start()
+    for i in xrange(20):
+        rc.success(0.1)
+    check(rc.rate <= rc.ceiling < rc.max_rate, 'kept under the ceiling')
+    check(rc.ceiling > ceiling, 'ceiling recovers slowly')
+    rc = ratecontrol.RateController(0)
+    rc.success(0.1)
+    rc.failure()
+    check(rc.rate is None and rc.interval() == 0, 'no limit without interval')
+
+def main():
+    for test in (check_breaker, check_failures, check_rate):
+        test()
+    if failures:
+        print "%d checks failed" % len(failures)
+        sys.exit(1)
+    print "All checks passed"
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+#
+# Regenerate the crawler database from the raw response archive
+# author: Wu Zhe <wu@madk.org>
+#
+# Usage: python rebuild.py [-j WORKERS] [-a ARCHIVE] [-o DB_PATH] [--force]
+#
+# Segments of the archive are decoded in parallel with the current
+# decoder and db.sql, and replayed in the order they were fetched, so
+# a schema change or a mapping fix needs no new crawl. The database is
+# written next to DB_PATH and moved in place when done.
+#
+
+import os, sys, re, cgi, sqlite3, time, optparse, multiprocessing
+from xml.parsers.expat import ExpatError
+import archive, decoder, tastes, compact
+
+SQL_PATH = os.path.normpath('db.sql')
+DB_PATH = os.path.normpath('../data.db')
+
+URI_RE = re.compile(r'^/people/([^/?]+)(?:/(friends|contacts|tags))?'
+                    r'(?:\?(.*))?$')
+
+def _uid(uri_id):
+    if uri_id.isdigit():
+        return int(uri_id)
+    return uri_id
+
+def replay(path):
+    """Decode the records of one segment into what rebuild() stores.
+
+    Returns a list, in the order of the records, of
+        ('people', uri_id, fetched, users row or None if gone)
+        ('list', uid, 'friends'|'contacts', start, fetched, users rows)
+        ('tags', uid, cat, start, fetched, [(tag, count)] or None if gone)
+    and the number of records that could not be decoded.
+    """
+    items = []
+    bad = 0
+    for fetched, uri, status, text in archive.read_segment(path):
+        m = URI_RE.match(uri)
+        if not m:
+            bad += 1
+            continue
+        uri_id, what, query = m.groups()
+        params = cgi.parse_qs(query or '')
+        start = int(params.get('start-index', ['1'])[0])
+        try:
+            if what is None:
+                row = None
+                if status != 404:
+                    row = decoder.decode('people', text)[0]
+                items.append(('people', _uid(uri_id), fetched, row))
+            elif what == 'tags':
+                tags = None
+                if status != 404:
+                    tags = decoder.decode('tags', text)[0]
+                items.append(('tags', _uid(uri_id), params['cat'][0], start,
+                              fetched, tags))
+            elif status != 404:
+                items.append(('list', _uid(uri_id), what, start, fetched,
+                              decoder.decode('friends', text)[0]))
+        except (SyntaxError, ExpatError, KeyError, ValueError):
+            bad += 1
+    return items, bad
+
+def _store_users(cursor, codec, fetched, rows):
+    # The first time a user was seen wins, as in the crawler
+    cursor.executemany("INSERT OR IGNORE INTO users VALUES (?,?,?,?,?,?,?,?)",
+                       codec.pack([tuple(row) + (fetched,) for row in rows]))
+
+def rebuild(conn, paths, workers=None):
+    """Replay the segments at paths into conn, a database made from
+    db.sql. Returns the number of records that could not be decoded."""
+    cursor = conn.cursor()
+    codec = compact.Codec(conn)
+    fetches = {} # (uid, list) -> [fetched, size] of the latest fetch
+    bad_total = 0
+    pool = multiprocessing.Pool(workers)
+    try:
+        for items, bad in pool.imap(replay, paths):
+            bad_total += bad
+            for item in items:
+                kind = item[0]
+                if kind == 'people':
+                    uri_id, fetched, row = item[1:]
+                    if row is None:
+                        fetches[(uri_id, 'people')] = [fetched, 0]
+                    else:
+                        _store_users(cursor, codec, fetched, [row])
+                        fetches[(row[0], 'people')] = [fetched, 1]
+                elif kind == 'list':
+                    uid, what, start, fetched, rows = item[1:]
+                    _store_users(cursor, codec, fetched, rows)
+                    others = [row[0] for row in rows]
+                    if what == 'friends':
+                        cursor.executemany("INSERT OR IGNORE INTO friends " +
+                                           "VALUES (?, ?)",
+                                           [(min(uid, other), max(uid, other))
+                                            for other in others])
+                    else:
+                        cursor.executemany("INSERT OR IGNORE INTO follows " +
+                                           "VALUES (?, ?)",
+                                           [(uid, other) for other in others])
+                    _count_fetch(fetches, uid, what, start == 1, fetched,
+                                 len(rows))
+                else:
+                    uid, cat, start, fetched, tags = item[1:]
+                    first = cat == tastes.TAG_CATS[0] and start == 1
+                    if tags is None: # the user is gone
+                        tags = []
+                        first = True
+                    cursor.executemany("INSERT OR REPLACE INTO tastes " +
+                                       "VALUES (?,?,?,?)",
+                                       [(uid, cat, tag, count)
+                                        for tag, count in tags])
+                    _count_fetch(fetches, uid, 'tags', first, fetched,
+                                 len(tags))
+            conn.commit()
+    finally:
+        pool.terminate()
+        pool.join()
+    cursor.executemany("INSERT OR REPLACE INTO fetches VALUES (?,?,?,?)",
+                       [key + tuple(value)
+                        for key, value in fetches.iteritems()])
+    conn.commit()
+    return bad_total
+
+def _count_fetch(fetches, uid, what, first, fetched, size):
+    """A fetch of a paged list starts at its first page, its size is the
+    entries on all pages and its time that of the last page."""
+    if first or (uid, what) not in fetches:
+        fetches[(uid, what)] = [fetched, size]
+    else:
+        fetches[(uid, what)][0] = fetched
+        fetches[(uid, what)][1] += size
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-j', '--workers', type='int', default=None,
+                      help='decoding processes, one per core by default')
+    parser.add_option('-a', '--archive', default=archive.ARCHIVE_PATH,
+                      help='archive to replay [%default]')
+    parser.add_option('-o', '--output', default=DB_PATH,
+                      help='database to write [%default]')
+    parser.add_option('--force', action='store_true', default=False,
+                      help='replace the database if it exists')
+    options, args = parser.parse_args()
+
+    if os.path.exists(options.output) and not options.force:
+        print "%s exists, use --force to replace it" % options.output
+        sys.exit(1)
+    paths = archive.segments(options.archive)
+    if not paths:
+        print "No segments in %s" % options.archive
+        sys.exit(1)
+
+    begin = time.time()
+    part_path = options.output + '.part'
+    if os.path.exists(part_path):
+        os.remove(part_path)
+    conn = sqlite3.connect(part_path)
+    conn.executescript(open(SQL_PATH).read())
+    conn.execute("PRAGMA synchronous = OFF")
+    bad = rebuild(conn, paths, options.workers)
+    count = conn.execute("SELECT count(*) FROM users").fetchone()[0]
+    conn.close()
+    os.rename(part_path, options.output)
+    print "Rebuilt %s from %d segments in %.1f seconds: %d users, %d " \
+          "records skipped" % (options.output, len(paths),
+                               time.time() - begin, count, bad)
+
+if __name__ == "__main__":
+    main()
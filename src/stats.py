@@ -0,0 +1,136 @@
+#
+# Statistics of the crawled social graph
+# author: Wu Zhe <wu@madk.org>
+#
+# Usage: python stats.py [DB_PATH [GRAPH_DIR]]
+#
+# Works on the arrays written by graph.py, exporting them first if
+# the database changed since GRAPH_DIR was exported, and stores the
+# results in the report tables below.
+#
+
+import os, sys, sqlite3, time
+
+import graph, numpy # graph tells to install numpy if it is missing
+
+REPORT_SQL = """
+CREATE TABLE IF NOT EXISTS degree_distribution (
+       graph TEXT,
+       degree INTEGER,
+       count INTEGER,
+       PRIMARY KEY (graph, degree)
+);
+
+CREATE TABLE IF NOT EXISTS graph_stats (
+       name TEXT,
+       value REAL,
+       computed DATE,
+       PRIMARY KEY (name)
+);
+"""
+
+def edges(g):
+    """The (src, dst) index arrays of all arcs in g."""
+    src = numpy.repeat(numpy.arange(g.n, dtype=graph.INDEX_TYPE),
+                       g.out_degrees())
+    return src, numpy.asarray(g.neighbours)
+
+def edge_keys(src, dst, n):
+    """One sorted int64 per arc, so arc sets can be intersected."""
+    keys = src.astype(numpy.int64) * n + dst
+    keys.sort()
+    return keys
+
+def degree_distribution(degrees):
+    """(degree, number of users) pairs for every degree that occurs."""
+    counts = numpy.bincount(degrees)
+    present = numpy.nonzero(counts)[0]
+    return zip(present.tolist(), counts[present].tolist())
+
+def overlap(keys, probe):
+    """Share of the arcs in `probe' that are also in `keys'."""
+    if len(probe) == 0:
+        return 0.0
+    return numpy.in1d(probe, keys).mean()
+
+def components(n, src, dst):
+    """Label each node with the smallest index in its component.
+
+    Vectorised Shiloach-Vishkin: every round hooks the root of one end
+    of each crossing edge to the smaller root, then compresses paths.
+    """
+    labels = numpy.arange(n, dtype=graph.INDEX_TYPE)
+    while len(src):
+        lu = labels[src]
+        lv = labels[dst]
+        crossing = lu != lv
+        src, dst = src[crossing], dst[crossing]
+        lu, lv = lu[crossing], lv[crossing]
+        if not len(src): break
+        labels[numpy.maximum(lu, lv)] = numpy.minimum(lu, lv)
+        while True:
+            parents = labels[labels]
+            if (parents == labels).all(): break
+            labels = parents
+    return labels
+
+def compute(friends, follows):
+    """Everything we report, as (degree rows, named values)."""
+    n = friends.n
+    fr_src, fr_dst = edges(friends)
+    fo_src, fo_dst = edges(follows)
+    fr_keys = edge_keys(fr_src, fr_dst, n)
+    fo_keys = edge_keys(fo_src, fo_dst, n)
+
+    distributions = [
+        ('friends', degree_distribution(friends.out_degrees())),
+        ('out_follows', degree_distribution(follows.out_degrees())),
+        ('in_follows', degree_distribution(follows.in_degrees()))]
+
+    labels = components(n, numpy.concatenate((fr_src, fo_src)),
+                        numpy.concatenate((fr_dst, fo_dst)))
+    sizes = numpy.bincount(labels)
+    sizes = sizes[sizes > 0]
+    values = [
+        ('users', n),
+        ('friend_pairs', len(fr_keys) / 2),
+        ('follows', len(fo_keys)),
+        # Followed back, as a share of all follows
+        ('follow_reciprocity', overlap(fo_keys, edge_keys(fo_dst, fo_src, n))),
+        # Friend arcs (both directions) that are follows too, and back
+        ('friends_also_followed', overlap(fo_keys, fr_keys)),
+        ('follows_also_friends', overlap(fr_keys, fo_keys)),
+        ('components', len(sizes)),
+        ('largest_component', sizes.max() if n else 0),
+        ('largest_component_share', n and float(sizes.max()) / n or 0.0)]
+    return distributions, values
+
+def store(conn, distributions, values):
+    cursor = conn.cursor()
+    cursor.executescript(REPORT_SQL)
+    for name, rows in distributions:
+        cursor.execute("DELETE FROM degree_distribution WHERE graph=?",
+                       (name,))
+        cursor.executemany("INSERT INTO degree_distribution VALUES (?,?,?)",
+                           [(name, d, c) for d, c in rows])
+    cursor.executemany("INSERT OR REPLACE INTO graph_stats VALUES " +
+                       "(?,?,DATETIME('NOW'))",
+                       [(name, float(value)) for name, value in values])
+    conn.commit()
+
+def main():
+    db_path = len(sys.argv) > 1 and sys.argv[1] or graph.DB_PATH
+    directory = len(sys.argv) > 2 and sys.argv[2] or graph.GRAPH_DIR
+    conn = sqlite3.connect(db_path)
+    graph.refresh(conn, directory)
+    begin = time.time()
+    distributions, values = compute(graph.load(directory, 'friends'),
+                                    graph.load(directory, 'follows'))
+    store(conn, distributions, values)
+    conn.close()
+    for name, value in values:
+        print "%s: %s" % (name, value)
+    print "Computed in %.1f seconds" % (time.time() - begin)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+#
+# Read-only statistics of a crawl in progress, over HTTP
+# author: Wu Zhe <wu@madk.org>
+#
+# Usage: python statserver.py [-p PORT] [-d DB_PATH] [-r READERS]
+#
+# The crawler keeps data.db in WAL mode, so readers work on a snapshot
+# and neither wait for its commits nor hold them up. Each request reads
+# from one of a few connections opened query_only, inside a single
+# transaction, and answers are cached for a few seconds so that however
+# often a dashboard polls, the database sees a handful of queries.
+#
+#   /users                      users stored
+#   /edges                      friends and follows stored
+#   /degrees?graph=friends      (degree, users) histogram, or follows
+#   /locations?limit=20         users in the top locations
+#   /fetches                    lists fetched, by list
+#
+
+import os, sys, sqlite3, time, json, optparse, urlparse, Queue
+import BaseHTTPServer, SocketServer
+import locations
+from cache import TTLCache
+
+DB_PATH = os.path.normpath('../data.db')
+PORT = 9109
+READERS = 4
+
+# Seconds an answer is served from the cache
+SHORT_TTL = 5
+LONG_TTL = 60 # for answers that scan a whole table
+
+class ReadPool:
+    """`size' read only connections to the database at `path', shared
+    by the request threads."""
+
+    def __init__(self, path, size=READERS):
+        self.connections = Queue.Queue()
+        for i in xrange(size):
+            conn = sqlite3.connect(path, timeout=60, check_same_thread=False,
+                                   isolation_level=None)
+            conn.execute("PRAGMA query_only = ON")
+            self.connections.put(conn)
+        self.journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+
+    def query(self, function, *args):
+        """function(conn, *args) on one snapshot of the database."""
+        conn = self.connections.get()
+        try:
+            conn.execute("BEGIN")
+            try:
+                return function(conn, *args)
+            finally:
+                conn.execute("COMMIT")
+        finally:
+            self.connections.put(conn)
+
+    def close(self):
+        while not self.connections.empty():
+            self.connections.get().close()
+
+def count_users(conn):
+    return conn.execute("SELECT coalesce(sum(users), 0) FROM "
+                        "location_users").fetchone()[0]
+
+def count_edges(conn):
+    counts = {'friends': 0, 'follows': 0}
+    counts.update(conn.execute("SELECT kind, sum(edges) FROM location_edges "
+                               "GROUP BY kind").fetchall())
+    return counts
+
+def degrees(conn, graph):
+    """(degree, users) of users with at least one friend, or following
+    at least one user."""
+    if graph == 'friends':
+        sql = "SELECT user1 AS uid FROM friends UNION ALL " \
+              "SELECT user2 FROM friends"
+    else:
+        sql = "SELECT from_user AS uid FROM follows"
+    return conn.execute("SELECT degree, count(*) FROM (SELECT count(*) AS "
+                        "degree FROM (%s) GROUP BY uid) GROUP BY degree "
+                        "ORDER BY degree" % sql).fetchall()
+
+def count_fetches(conn):
+    return dict(conn.execute("SELECT list, count(*) FROM fetches "
+                             "GROUP BY list").fetchall())
+
+def _int(params, name, default):
+    try:
+        return int(params.get(name, [default])[0])
+    except ValueError:
+        return default
+
+def answer(pool, cache, path):
+    """The answer to GET path, None for an unknown path."""
+    url = urlparse.urlparse(path)
+    params = urlparse.parse_qs(url.query)
+    if url.path == '/users':
+        key, ttl, args = ('users',), SHORT_TTL, (count_users,)
+    elif url.path == '/edges':
+        key, ttl, args = ('edges',), SHORT_TTL, (count_edges,)
+    elif url.path == '/degrees':
+        graph = params.get('graph', ['friends'])[0]
+        if graph not in ('friends', 'follows'):
+            return None
+        key, ttl, args = ('degrees', graph), LONG_TTL, (degrees, graph)
+    elif url.path == '/locations':
+        limit = _int(params, 'limit', 20)
+        key, ttl, args = ('locations', limit), SHORT_TTL, \
+                         (locations.user_counts, limit)
+    elif url.path == '/fetches':
+        key, ttl, args = ('fetches',), SHORT_TTL, (count_fetches,)
+    else:
+        return None
+    body = cache.get(key)
+    if body is None:
+        body = json.dumps(pool.query(*args))
+        cache.put(key, body, ttl)
+    return body
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+def serve(pool, port=PORT, host='127.0.0.1'):
+    cache = TTLCache()
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            try:
+                body = answer(pool, cache, self.path)
+            except sqlite3.Error, e:
+                self.send_error(503, str(e))
+                return
+            if body is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        def log_message(self, *args):
+            pass
+    return Server((host, port), Handler)
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-p', '--port', type='int', default=PORT,
+                      help='port to listen on, on localhost [%default]')
+    parser.add_option('-d', '--db', default=DB_PATH,
+                      help='crawler database [%default]')
+    parser.add_option('-r', '--readers', type='int', default=READERS,
+                      help='read connections [%default]')
+    options, args = parser.parse_args()
+
+    if not os.path.exists(options.db):
+        print "%s does not exist" % options.db
+        sys.exit(1)
+    pool = ReadPool(options.db, options.readers)
+    if pool.journal_mode != 'wal':
+        print "Warning: %s is in %s mode, queries and the crawler will " \
+              "wait for each other" % (options.db, pool.journal_mode)
+    server = serve(pool, options.port)
+    print "Serving %s on http://127.0.0.1:%d/" % (options.db, options.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    pool.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,687 @@
+#
+# Where the crawler keeps users, edges, fetches and its frontier
+# author: Wu Zhe <wu@madk.org>
+#
+# Usage: python storage.py LOG_PATH DB_PATH
+#
+# copies a crawl kept by LogStorage into a new SQLite database, for
+# graph.py, stats.py and the other tools that read data.db.
+#
+# Two backends implement Storage:
+#
+#   SQLiteStorage  data.db as always, in WAL mode, committing once per
+#                  visited user
+#   LogStorage     append-only logs for users, fetches and tags, and
+#                  edges in sorted segment files, for bulk crawls that
+#                  mostly write
+#
+# storage_check.py runs the same conformance checks and benchmark on
+# both.
+#
+
+import os, sys, time, struct, array, mmap, marshal, heapq, pickle, sqlite3
+from collections import deque
+import migrate, compact, changelog
+
+SQL_PATH = os.path.normpath('db.sql')
+DB_PATH = os.path.normpath('../data.db')
+LOG_PATH = os.path.normpath('../data.log')
+QUEUE_PATH = os.path.normpath('../user_queue.pkl') # pickle
+VISITED_PATH = os.path.normpath('../visited_users.pkl') # pickle
+
+LISTS = ('people', 'friends', 'contacts', 'tags') # kinds of fetches
+
+class StorageError(Exception): pass
+
+class Storage:
+    """What the crawler needs to keep, whatever keeps it.
+
+    Users are rows of the `users' table in db.sql, first one stored
+    wins. Friends are symmetric, follows are not. A fetch records when a
+    list of a user was last fetched from the API and its size. Writes
+    survive a crash of the crawler once commit() returns.
+
+    Every user and edge added is numbered in a log of changes, so jobs
+    can pick up where they left off, see changelog.py.
+    """
+
+    queue_path = QUEUE_PATH
+    visited_path = VISITED_PATH
+
+    def user(self, uri_id):
+        """The users row of uid or uid_text `uri_id', None if unknown."""
+        raise NotImplementedError
+
+    def uids(self):
+        """A set of the uids of all users stored."""
+        raise NotImplementedError
+
+    def count_users(self):
+        return len(self.uids())
+
+    def add_users(self, rows):
+        """Store the users rows that are not stored yet."""
+        raise NotImplementedError
+
+    def friends(self, uid):
+        raise NotImplementedError
+
+    def follows(self, uid):
+        raise NotImplementedError
+
+    def followers(self, uid):
+        raise NotImplementedError
+
+    def add_friends(self, uid, others):
+        raise NotImplementedError
+
+    def add_follows(self, uid, others):
+        raise NotImplementedError
+
+    def fetched(self, uid, what, ttl):
+        """Size of uid's `what' list when fetched in the last `ttl'
+        days, None if it was not."""
+        raise NotImplementedError
+
+    def log_fetch(self, uid, what, size):
+        raise NotImplementedError
+
+    def tags(self, uid):
+        """(cat, tag, count) of uid's tags."""
+        raise NotImplementedError
+
+    def add_tags(self, rows):
+        """Store (uid, cat, tag, count) rows, replacing older counts."""
+        raise NotImplementedError
+
+    def changes(self, since=0, limit=None):
+        """(seq, kind, a, b) of what was added after change `since',
+        oldest first. kind is 'users' with a the uid and b None, or
+        'friends' or 'follows' with the pair as stored."""
+        raise NotImplementedError
+
+    def last_change(self):
+        """The sequence number of the latest change, 0 if none."""
+        raise NotImplementedError
+
+    def commit(self):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def prefetch(self, uri_ids, ttl):
+        """What is stored about each of uri_ids, see crawler.User(known=).
+
+        Users not stored get no data. A fetch of a user that is gone is
+        logged under the uri_id asked for.
+        """
+        known = {}
+        for uri_id in uri_ids:
+            row = self.user(uri_id)
+            uid = row and row[0] or uri_id
+            fetched = {}
+            for what in LISTS:
+                size = self.fetched(uid, what, ttl)
+                if size is not None:
+                    fetched[what] = size
+            known[uri_id] = {'data': row, 'fetched': fetched,
+                             'friends': row and list(self.friends(uid)) or [],
+                             'follows': row and list(self.follows(uid)) or []}
+        return known
+
+    def load_frontier(self, seeds):
+        """The queue and visited set saved last, or seeds to start with."""
+        queue = deque(seeds)
+        visited = set()
+        if os.path.exists(self.queue_path):
+            pkl_file = open(self.queue_path, 'rb')
+            queue = pickle.load(pkl_file)
+            pkl_file.close()
+        if os.path.exists(self.visited_path):
+            pkl_file = open(self.visited_path, 'rb')
+            visited = pickle.load(pkl_file)
+            pkl_file.close()
+        return queue, visited
+
+    def save_frontier(self, queue, visited):
+        for path, value in ((self.queue_path, queue),
+                            (self.visited_path, visited)):
+            if value:
+                pkl_file = open(path, 'wb')
+                pickle.dump(value, pkl_file)
+                pkl_file.close()
+
+class SQLiteStorage(Storage):
+    """data.db, created from db.sql if it does not exist."""
+
+    def __init__(self, path=DB_PATH):
+        create = path == ':memory:' or not os.path.exists(path)
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.cursor = self.conn.cursor()
+        if create:
+            self.cursor.executescript(open(SQL_PATH).read())
+            self.conn.commit()
+        elif migrate.schema_version(self.conn) < migrate.LATEST:
+            self.conn.close()
+            raise StorageError("%s predates the current schema, run "
+                               "migrate.py first" % path)
+        # The tastes thread reads while the crawler writes
+        self.cursor.execute("PRAGMA journal_mode = WAL;")
+        self.cursor.execute("PRAGMA cache_size = 20000;")
+        self.cursor.execute("PRAGMA synchronous = NORMAL;")
+        self.cursor.execute("PRAGMA temp_store = MEMORY;")
+        self.codec = compact.Codec(self.conn)
+
+    def _select(self, sql, params=()):
+        self.cursor.execute(sql, params)
+        return self.cursor.fetchall()
+
+    def user(self, uri_id):
+        rows = self._select("SELECT * FROM users WHERE uid=? OR uid_text=?",
+                            (uri_id, str(uri_id)))
+        if rows:
+            return self.codec.unpack(rows[0])
+
+    def uids(self):
+        return set([x[0] for x in self._select("SELECT uid FROM users")])
+
+    def count_users(self):
+        return self._select("SELECT count(*) FROM users")[0][0]
+
+    def add_users(self, rows):
+        self.cursor.executemany("INSERT OR IGNORE INTO users VALUES " +
+                                "(?,?,?,?,?,?,?,DATETIME('NOW'))",
+                                self.codec.pack(rows))
+
+    def friends(self, uid):
+        return [x[0] for x in self._select("SELECT user2 FROM friends " +
+                                           "WHERE user1=? UNION ALL " +
+                                           "SELECT user1 FROM friends " +
+                                           "WHERE user2=?", (uid, uid))]
+
+    def follows(self, uid):
+        return [x[0] for x in self._select("SELECT to_user FROM follows " +
+                                           "WHERE from_user=?", (uid,))]
+
+    def followers(self, uid):
+        return [x[0] for x in self._select("SELECT from_user FROM follows " +
+                                           "WHERE to_user=?", (uid,))]
+
+    def add_friends(self, uid, others):
+        # Friendship is symmetric, store each pair once as (min, max)
+        self.cursor.executemany("INSERT OR IGNORE INTO friends VALUES (?, ?)",
+                                [(min(uid, other), max(uid, other))
+                                 for other in others])
+
+    def add_follows(self, uid, others):
+        self.cursor.executemany("INSERT OR IGNORE INTO follows VALUES (?, ?)",
+                                [(uid, other) for other in others])
+
+    def fetched(self, uid, what, ttl):
+        # Fetches backfilled from old databases have no date and count
+        # as recent
+        rows = self._select("SELECT size FROM fetches WHERE uid=? AND " +
+                            "list=? AND (fetched IS NULL OR fetched > " +
+                            "DATETIME('NOW', ?))",
+                            (uid, what, '-%d days' % ttl))
+        if rows:
+            return rows[0][0] or 0
+
+    def log_fetch(self, uid, what, size):
+        self.cursor.execute("INSERT OR REPLACE INTO fetches VALUES " +
+                            "(?,?,DATETIME('NOW'),?)", (uid, what, size))
+
+    def tags(self, uid):
+        return self._select("SELECT cat, tag, count FROM tastes WHERE uid=?",
+                            (uid,))
+
+    def add_tags(self, rows):
+        self.cursor.executemany("INSERT OR REPLACE INTO tastes VALUES " +
+                                "(?,?,?,?)", rows)
+
+    def changes(self, since=0, limit=None):
+        return changelog.read(self.conn, since, limit)
+
+    def last_change(self):
+        return changelog.last(self.conn)
+
+    def commit(self):
+        # Once per visited user: the write lock is held from the first
+        # page stored, and the tastes thread waits for it
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def prefetch(self, uri_ids, ttl):
+        """A handful of set-based queries instead of several per user.
+
+        Friend pairs stored after this by visits of other users are not
+        seen, but those users are visited already.
+        """
+        cursor = self.cursor
+        known = {}
+        for uri_id in uri_ids:
+            known[uri_id] = {'data': None, 'fetched': {}, 'friends': [],
+                             'follows': []}
+        by_uid = {}
+        marks = ','.join(['?'] * len(uri_ids))
+        texts = [str(x) for x in uri_ids]
+        cursor.execute("SELECT * FROM users WHERE uid IN (%s) OR uid_text "
+                       "IN (%s)" % (marks, marks), list(uri_ids) + texts)
+        for row in cursor.fetchall():
+            row = self.codec.unpack(row)
+            for key in (row[0], row[1]):
+                if key in known:
+                    known[key]['data'] = row
+                    by_uid[row[0]] = known[key]
+        # Users that are gone are logged under the uri_id we asked for
+        ids = list(set(uri_ids) | set(by_uid))
+        cursor.execute("SELECT uid, list, size FROM fetches WHERE uid IN "
+                       "(%s) " % ','.join(['?'] * len(ids)) +
+                       "AND (fetched IS NULL OR fetched > DATETIME('NOW', ?))",
+                       ids + ['-%d days' % ttl])
+        for uid, what, size in cursor.fetchall():
+            (by_uid.get(uid) or known[uid])['fetched'][what] = size or 0
+
+        uids = by_uid.keys()
+        if uids:
+            marks = ','.join(['?'] * len(uids))
+            cursor.execute("SELECT user1, user2 FROM friends WHERE user1 IN "
+                           "(%s) UNION ALL SELECT user2, user1 FROM friends "
+                           "WHERE user2 IN (%s)" % (marks, marks), uids + uids)
+            for uid, other in cursor.fetchall():
+                by_uid[uid]['friends'].append(other)
+            cursor.execute("SELECT from_user, to_user FROM follows "
+                           "WHERE from_user IN (%s)" % marks, uids)
+            for uid, other in cursor.fetchall():
+                by_uid[uid]['follows'].append(other)
+        return known
+
+PAIR = struct.Struct('ii') # (key, value) in an edge segment, as array('i')
+CHANGE = struct.Struct('=Bii') # (kind, a, b) in changes.log
+
+class _Segment:
+    """A file of (key, value) pairs of uids sorted by key, then value."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.count = os.path.getsize(path) / PAIR.size
+        self.map = None
+        if self.count:
+            self.map = mmap.mmap(self.file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+
+    def get(self, key):
+        """The values paired with key, by binary search."""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) / 2
+            if PAIR.unpack_from(self.map, mid * PAIR.size)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        values = []
+        while lo < self.count:
+            k, v = PAIR.unpack_from(self.map, lo * PAIR.size)
+            if k != key: break
+            values.append(v)
+            lo += 1
+        return values
+
+    def __iter__(self):
+        chunk = 65536 # pairs read at once
+        for begin in xrange(0, self.count, chunk):
+            flat = array.array('i')
+            flat.fromstring(self.map[begin * PAIR.size:
+                                     min(begin + chunk, self.count) *
+                                     PAIR.size])
+            for i in xrange(0, len(flat), 2):
+                yield flat[i], flat[i + 1]
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+def _write_segment(path, pairs):
+    """Write sorted pairs to path, whole or not at all."""
+    f = open(path + '.tmp', 'wb')
+    flat = array.array('i')
+    for k, v in pairs:
+        flat.append(k)
+        flat.append(v)
+        if len(flat) >= 131072:
+            flat.tofile(f)
+            flat = array.array('i')
+    flat.tofile(f)
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    os.rename(path + '.tmp', path)
+
+def _read_log(path):
+    """The marshalled records in the log at path. A record cut short by
+    a crash is dropped from the file."""
+    records = []
+    if not os.path.exists(path):
+        return records
+    f = open(path, 'r+b')
+    while True:
+        offset = f.tell()
+        try:
+            records.append((offset, marshal.load(f)))
+        except (EOFError, ValueError, TypeError):
+            f.truncate(offset)
+            break
+    f.close()
+    return records
+
+class LogStorage(Storage):
+    """A directory of append-only logs and sorted edge segments.
+
+    Users, fetches and tags are appended to logs and indexed in memory
+    when opened. New edges go to a log and an in-memory table, which is
+    written out as sorted segments once it holds `segment_pairs' pairs.
+    Lookups binary search every segment, so once there are more than
+    `max_segments' of a kind they are merged into one. Friends are kept
+    in both directions. Uids must fit in 32 bits.
+    """
+
+    EDGE_KINDS = ('friends', 'follows', 'followers')
+
+    def __init__(self, path=LOG_PATH, segment_pairs=1000000, max_segments=8):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.queue_path = os.path.join(path, 'queue.pkl')
+        self.visited_path = os.path.join(path, 'visited.pkl')
+        self.segment_pairs = segment_pairs
+        self.max_segments = max_segments
+
+        self.offsets = {} # uid -> offset of its row in users.log
+        self.by_text = {} # uid_text -> uid
+        for offset, row in _read_log(self._file('users.log')):
+            if row[0] not in self.offsets:
+                self.offsets[row[0]] = offset
+                if row[1]:
+                    self.by_text[row[1]] = row[0]
+        self.fetches = {} # (uid, list) -> (time, size)
+        for offset, (uid, what, when, size) in \
+                _read_log(self._file('fetches.log')):
+            self.fetches[(uid, what)] = (when, size)
+        self.tag_offsets = {} # uid -> offset of its tags in tastes.log
+        for offset, (uid, rows) in _read_log(self._file('tastes.log')):
+            self.tag_offsets[uid] = offset
+
+        self.segments = {}
+        self.numbers = {}
+        for kind in self.EDGE_KINDS:
+            numbered = []
+            for name in os.listdir(path):
+                if name.startswith(kind + '-') and name.endswith('.seg'):
+                    numbered.append((int(name[len(kind) + 1:-4]), name))
+            numbered.sort()
+            self.segments[kind] = [_Segment(self._file(name))
+                                   for n, name in numbered]
+            self.numbers[kind] = numbered and numbered[-1][0] or 0
+        self.memtable = dict([(kind, {}) for kind in self.EDGE_KINDS])
+        self.mem_pairs = 0
+        for offset, (kind, uid, others) in _read_log(self._file('edges.log')):
+            self._add_edges(kind, uid, others)
+
+        self.logs = {}
+        for name in ('users', 'fetches', 'tastes', 'edges'):
+            self.logs[name] = open(self._file(name + '.log'), 'ab')
+            self.logs[name].seek(0, 2) # for tell()
+        self.readers = {'users': open(self._file('users.log'), 'rb'),
+                        'tastes': open(self._file('tastes.log'), 'rb')}
+
+        # Fixed size records, change n at (n - 1) * CHANGE.size
+        changes_path = self._file('changes.log')
+        self.changes_log = open(changes_path, 'ab')
+        size = os.path.getsize(changes_path)
+        self.changes_log.truncate(size - size % CHANGE.size)
+        self.changes_log.seek(0, 2)
+        self.seq = self.changes_log.tell() / CHANGE.size
+        self.changes_reader = open(changes_path, 'rb')
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _read(self, name, offset):
+        self.logs[name].flush()
+        reader = self.readers[name]
+        reader.seek(offset)
+        return marshal.load(reader)
+
+    def user(self, uri_id):
+        uid = uri_id
+        if uid not in self.offsets:
+            uid = self.by_text.get(str(uri_id))
+            if uid is None:
+                return None
+        return tuple(self._read('users', self.offsets[uid]))
+
+    def uids(self):
+        return set(self.offsets)
+
+    def count_users(self):
+        return len(self.offsets)
+
+    def add_users(self, rows):
+        log = self.logs['users']
+        now = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+        for row in rows:
+            if row[0] in self.offsets:
+                continue
+            self.offsets[row[0]] = log.tell()
+            if row[1]:
+                self.by_text[row[1]] = row[0]
+            marshal.dump(tuple(row) + (now,), log)
+            self._log_change(changelog.USER, row[0], 0)
+
+    def _log_change(self, kind, a, b):
+        self.changes_log.write(CHANGE.pack(kind, a, b))
+        self.seq += 1
+
+    def changes(self, since=0, limit=None):
+        self.changes_log.flush()
+        upto = self.seq
+        if limit is not None:
+            upto = min(upto, since + limit)
+        self.changes_reader.seek(since * CHANGE.size)
+        data = self.changes_reader.read((upto - since) * CHANGE.size)
+        for i in xrange(0, len(data), CHANGE.size):
+            kind, a, b = CHANGE.unpack_from(data, i)
+            yield since + i / CHANGE.size + 1, changelog.KINDS[kind], a, \
+                  kind != changelog.USER and b or None
+
+    def last_change(self):
+        return self.seq
+
+    def _new_edges(self, kind, uid, others):
+        """others without the edges of uid stored already, or repeated."""
+        seen = set(self._edges(kind, uid))
+        new = []
+        for other in others:
+            if other not in seen:
+                seen.add(other)
+                new.append(other)
+        return new
+
+    def _add_edges(self, kind, uid, others):
+        if kind == 'friends':
+            pairs = [(uid, other) for other in others] + \
+                    [(other, uid) for other in others]
+            tables = (('friends', pairs),)
+        else:
+            tables = (('follows', [(uid, other) for other in others]),
+                      ('followers', [(other, uid) for other in others]))
+        for kind, pairs in tables:
+            table = self.memtable[kind]
+            for k, v in pairs:
+                table.setdefault(k, set()).add(v)
+            self.mem_pairs += len(pairs)
+
+    def _edges(self, kind, uid):
+        values = set(self.memtable[kind].get(uid, ()))
+        for segment in self.segments[kind]:
+            values.update(segment.get(uid))
+        return list(values)
+
+    def friends(self, uid):
+        return self._edges('friends', uid)
+
+    def follows(self, uid):
+        return self._edges('follows', uid)
+
+    def followers(self, uid):
+        return self._edges('followers', uid)
+
+    def add_friends(self, uid, others):
+        others = self._new_edges('friends', uid, others)
+        marshal.dump(('friends', uid, others), self.logs['edges'])
+        self._add_edges('friends', uid, others)
+        for other in others:
+            self._log_change(changelog.FRIENDS, min(uid, other),
+                             max(uid, other))
+
+    def add_follows(self, uid, others):
+        others = self._new_edges('follows', uid, others)
+        marshal.dump(('follows', uid, others), self.logs['edges'])
+        self._add_edges('follows', uid, others)
+        for other in others:
+            self._log_change(changelog.FOLLOWS, uid, other)
+
+    def fetched(self, uid, what, ttl):
+        when, size = self.fetches.get((uid, what), (None, None))
+        if when is not None and when > time.time() - ttl * 86400:
+            return size
+
+    def log_fetch(self, uid, what, size):
+        record = (uid, what, time.time(), size)
+        marshal.dump(record, self.logs['fetches'])
+        self.fetches[(uid, what)] = record[2:]
+
+    def tags(self, uid):
+        if uid not in self.tag_offsets:
+            return []
+        return [tuple(row) for row in self._read('tastes',
+                                                 self.tag_offsets[uid])[1]]
+
+    def add_tags(self, rows):
+        by_uid = {}
+        for uid, cat, tag, count in rows:
+            by_uid.setdefault(uid, []).append((cat, tag, count))
+        log = self.logs['tastes']
+        for uid, new in by_uid.iteritems():
+            merged = dict([((cat, tag), count)
+                           for cat, tag, count in self.tags(uid) + new])
+            self.tag_offsets[uid] = log.tell()
+            marshal.dump((uid, [(cat, tag, count) for (cat, tag), count
+                                in sorted(merged.items())]), log)
+
+    def commit(self):
+        # Changes last, so none is ever logged without its data
+        for log in self.logs.values() + [self.changes_log]:
+            log.flush()
+            os.fsync(log.fileno())
+        if self.mem_pairs >= self.segment_pairs:
+            self.flush_edges()
+
+    def flush_edges(self):
+        """Write the in-memory edges out as one segment of each kind."""
+        for kind in self.EDGE_KINDS:
+            table = self.memtable[kind]
+            if not table: continue
+            pairs = [(k, v) for k in sorted(table) for v in sorted(table[k])]
+            self._new_segment(kind, pairs)
+            self.memtable[kind] = {}
+        self.mem_pairs = 0
+        # Everything in the edge log is in segments now
+        self.logs['edges'].close()
+        self.logs['edges'] = open(self._file('edges.log'), 'wb')
+        for kind in self.EDGE_KINDS:
+            if len(self.segments[kind]) > self.max_segments:
+                self.compact(kind)
+
+    def _new_segment(self, kind, pairs):
+        self.numbers[kind] += 1
+        path = self._file('%s-%06d.seg' % (kind, self.numbers[kind]))
+        _write_segment(path, pairs)
+        self.segments[kind].append(_Segment(path))
+
+    def _merged(self, kind):
+        """The pairs of all segments of a kind, sorted and unique."""
+        last = None
+        for pair in heapq.merge(*self.segments[kind]):
+            if pair != last:
+                yield pair
+                last = pair
+
+    def compact(self, kind):
+        """Merge the segments of a kind into one."""
+        old = list(self.segments[kind])
+        self._new_segment(kind, self._merged(kind))
+        self.segments[kind] = self.segments[kind][-1:]
+        for segment in old:
+            segment.close()
+            os.remove(segment.path)
+
+    def iter_users(self):
+        for offset in sorted(self.offsets.values()):
+            yield tuple(self._read('users', offset))
+
+    def iter_edges(self, kind):
+        """(user1, user2) of friends once each, or (from, to) of follows."""
+        self.flush_edges()
+        for k, v in self._merged(kind):
+            if kind == 'follows' or k < v:
+                yield k, v
+
+    def close(self):
+        self.commit()
+        for f in self.logs.values() + self.readers.values() + \
+                [self.changes_log, self.changes_reader]:
+            f.close()
+        for kind in self.EDGE_KINDS:
+            for segment in self.segments[kind]:
+                segment.close()
+
+def to_sqlite(log, db):
+    """Copy a LogStorage into a SQLiteStorage."""
+    users = list(log.iter_users())
+    db.cursor.executemany("INSERT OR IGNORE INTO users VALUES " +
+                          "(?,?,?,?,?,?,?,?)", db.codec.pack(users))
+    db.cursor.executemany("INSERT OR IGNORE INTO friends VALUES (?, ?)",
+                          log.iter_edges('friends'))
+    db.cursor.executemany("INSERT OR IGNORE INTO follows VALUES (?, ?)",
+                          log.iter_edges('follows'))
+    for uid in log.tag_offsets:
+        db.add_tags([(uid,) + row for row in log.tags(uid)])
+    db.cursor.executemany("INSERT OR REPLACE INTO fetches VALUES " +
+                          "(?,?,DATETIME(?, 'unixepoch'),?)",
+                          [(uid, what, when, size) for (uid, what),
+                           (when, size) in log.fetches.iteritems()])
+    db.conn.commit()
+
+def main():
+    if len(sys.argv) != 3:
+        print "Usage: python storage.py LOG_PATH DB_PATH"
+        sys.exit(1)
+    if os.path.exists(sys.argv[2]):
+        print "%s exists, not overwriting it" % sys.argv[2]
+        sys.exit(1)
+    log = LogStorage(sys.argv[1])
+    db = SQLiteStorage(sys.argv[2])
+    to_sqlite(log, db)
+    print "Copied %d users to %s" % (db.count_users(), sys.argv[2])
+    db.close()
+    log.close()
+
+if __name__ == "__main__":
+    main()
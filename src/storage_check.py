@@ -0,0 +1,201 @@
+#
+# Conformance checks and benchmark for the storage backends
+# author: Wu Zhe <wu@madk.org>
+#
+# Usage: python storage_check.py [-n USERS] [-d DEGREE] [sqlite|log ...]
+#
+# Every backend in storage.py must pass the same checks. The benchmark
+# then stores a synthetic crawl of USERS users with DEGREE friends and
+# follows each, committing after each user as the crawler does, and
+# reads it back.
+#
+
+import os, sys, time, random, shutil, tempfile, optparse
+import storage
+
+def open_backend(kind, path, reopen=False):
+    if kind == 'sqlite':
+        return storage.SQLiteStorage(os.path.join(path, 'data.db'))
+    # Small segments, so that the checks cover segments and compaction
+    return storage.LogStorage(os.path.join(path, 'data.log'),
+                              segment_pairs=reopen and 1000000 or 8,
+                              max_segments=2)
+
+def row(uid):
+    return (uid, 'u%d' % uid, u'\u5317\u4eac', 'nick%d' % uid,
+            'http://img3.douban.com/icon/u%d-1.jpg' % uid, None,
+            u'desc \u4e2d\u6587 %d' % uid)
+
+failures = []
+
+def check(cond, message):
+    if not cond:
+        failures.append(message)
+        print "  FAIL:", message
+
+def check_users(s):
+    s.add_users([row(1), row(2)])
+    s.add_users([row(2)[:3] + ('changed',) + row(2)[4:], row(3)])
+    s.commit()
+    check(tuple(s.user(1)[:7]) == row(1), 'user by uid')
+    check(tuple(s.user('u2')[:7]) == row(2), 'user by uid_text')
+    check(s.user(2)[3] == 'nick2', 'first row stored wins')
+    check(s.user(4) is None and s.user('u4') is None, 'unknown user')
+    check(len(s.user(3)) == 8 and s.user(3)[7], 'row has a time added')
+    check(s.uids() == set([1, 2, 3]), 'uids')
+    check(s.count_users() == 3, 'count_users')
+
+def check_edges(s):
+    s.add_friends(1, [2, 3])
+    s.add_friends(3, [1, 4])
+    s.add_follows(1, [2, 5])
+    s.add_follows(2, [5])
+    s.add_follows(1, [2])
+    s.commit()
+    check(sorted(s.friends(1)) == [2, 3], 'friends once each')
+    check(sorted(s.friends(3)) == [1, 4], 'friends symmetric')
+    check(sorted(s.friends(4)) == [3], 'friends of a user not stored')
+    check(sorted(s.follows(1)) == [2, 5], 'follows')
+    check(sorted(s.followers(5)) == [1, 2], 'followers')
+    check(list(s.follows(5)) == [], 'no follows')
+
+def check_many_edges(s):
+    for uid in xrange(10, 40):
+        s.add_friends(uid, [uid + 1])
+        s.add_follows(uid, [uid + 1])
+        s.commit()
+    check(sorted(s.friends(20)) == [19, 21], 'friends after many commits')
+    check(sorted(s.followers(40)) == [39], 'followers after many commits')
+    check(sorted(s.friends(1)) == [2, 3], 'old friends after many commits')
+
+def check_fetches(s):
+    s.log_fetch(1, 'friends', 2)
+    s.log_fetch(1, 'friends', 3)
+    s.log_fetch('gone', 'people', 0)
+    s.commit()
+    check(s.fetched(1, 'friends', 90) == 3, 'latest fetch')
+    check(s.fetched(1, 'contacts', 90) is None, 'list not fetched')
+    check(s.fetched('gone', 'people', 90) == 0, 'gone user')
+    check(s.fetched(1, 'friends', -1) is None, 'fetch out of date')
+
+def check_tags(s):
+    s.add_tags([(1, 'book', 'scifi', 3), (1, 'movie', 'noir', 1)])
+    s.add_tags([(1, 'book', 'scifi', 4), (2, 'music', 'jazz', 2)])
+    s.commit()
+    check(sorted(s.tags(1)) == [('book', 'scifi', 4), ('movie', 'noir', 1)],
+          'tags replaced by tag')
+    check(list(s.tags(3)) == [], 'no tags')
+
+def check_changes(s):
+    changes = list(s.changes())
+    kinds = [change[1] for change in changes]
+    check([change[0] for change in changes] == range(1, s.last_change() + 1),
+          'changes numbered in order')
+    check((kinds.count('users'), kinds.count('friends'),
+           kinds.count('follows')) == (3, 33, 33), 'changes of each kind')
+    check(changes[0] == (1, 'users', 1, None), 'user change')
+    check(('friends', 3, 4) in [change[1:] for change in changes],
+          'friends change as stored')
+    last = s.last_change()
+    s.add_friends(2, [1])
+    s.add_follows(60, [61, 61])
+    s.commit()
+    check(list(s.changes(last)) == [(last + 1, 'follows', 60, 61)],
+          'only new edges logged')
+    check([change[0] for change in s.changes(2, 3)] == [3, 4, 5],
+          'changes with a limit')
+
+def check_prefetch(s):
+    known = s.prefetch([1, 'u2', 'gone', 99], 90)
+    check(known[1]['data'][0] == 1 and known['u2']['data'][0] == 2,
+          'prefetch rows')
+    check(known[99]['data'] is None, 'prefetch unknown user')
+    check(sorted(known[1]['friends']) == [2, 3], 'prefetch friends')
+    check(sorted(known[1]['follows']) == [2, 5], 'prefetch follows')
+    check(known[1]['fetched'] == {'friends': 3}, 'prefetch fetches')
+    check(known['gone']['fetched'] == {'people': 0}, 'prefetch gone user')
+
+def check_frontier(s):
+    from collections import deque
+    queue, visited = s.load_frontier((7, 8))
+    check(list(queue) == [7, 8] and visited == set(), 'frontier seeds')
+    s.save_frontier(deque([9]), set([7, 8]))
+    queue, visited = s.load_frontier((7, 8))
+    check(list(queue) == [9] and visited == set([7, 8]), 'saved frontier')
+
+def conformance(kind, path):
+    s = open_backend(kind, path)
+    if kind == 'sqlite': # keep the frontier out of ../
+        s.queue_path = os.path.join(path, 'queue.pkl')
+        s.visited_path = os.path.join(path, 'visited.pkl')
+    for test in (check_users, check_edges, check_many_edges, check_fetches,
+                 check_tags, check_changes, check_prefetch, check_frontier):
+        test(s)
+    last = s.last_change()
+    s.close()
+    # Everything committed is there when opened again
+    s = open_backend(kind, path, reopen=True)
+    check(s.uids() == set([1, 2, 3]), 'users after reopening')
+    check(sorted(s.friends(3)) == [1, 4], 'friends after reopening')
+    check(sorted(s.followers(5)) == [1, 2], 'followers after reopening')
+    check(s.fetched(1, 'friends', 90) == 3, 'fetches after reopening')
+    check(s.last_change() == last, 'changes after reopening')
+    check(sorted(s.tags(1)) == [('book', 'scifi', 4), ('movie', 'noir', 1)],
+          'tags after reopening')
+    s.close()
+
+def benchmark(kind, path, users, degree):
+    s = open_backend(kind, path, reopen=True)
+    rand = random.Random(42)
+    population = users * 10
+    begin = time.time()
+    for uid in xrange(1, users + 1):
+        others = rand.sample(xrange(1, population), degree)
+        s.add_users([row(other) for other in others])
+        s.add_friends(uid, others)
+        s.add_follows(uid, others)
+        s.log_fetch(uid, 'friends', degree)
+        s.log_fetch(uid, 'contacts', degree)
+        s.commit()
+    write_time = time.time() - begin
+    begin = time.time()
+    for uid in xrange(1, users + 1):
+        s.user(uid)
+        s.friends(uid)
+        s.followers(uid)
+    read_time = time.time() - begin
+    begin = time.time()
+    for i in xrange(0, users, 200):
+        s.prefetch(range(i + 1, min(i + 201, users + 1)), 90)
+    prefetch_time = time.time() - begin
+    s.close()
+    print "  %d users: %.0f users/s stored, %.0f users/s read, " \
+          "%.0f users/s prefetched" % (users, users / write_time,
+                                       users / read_time,
+                                       users / prefetch_time)
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--users', type='int', default=2000,
+                      help='users in the benchmark crawl [%default]')
+    parser.add_option('-d', '--degree', type='int', default=50,
+                      help='friends and follows of each user [%default]')
+    options, args = parser.parse_args()
+    for kind in args or ['sqlite', 'log']:
+        print kind
+        for run in (conformance, benchmark):
+            path = tempfile.mkdtemp(prefix='storage_check')
+            try:
+                if run is conformance:
+                    run(kind, path)
+                else:
+                    run(kind, path, options.users, options.degree)
+            finally:
+                shutil.rmtree(path)
+    if failures:
+        print "%d checks failed" % len(failures)
+        sys.exit(1)
+    print "All checks passed"
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#
+# Targeted crawls: the graph around some seeds instead of all of douban
+# author: Wu Zhe <wu@madk.org>
+#
+# The crawler visits users breadth first from the seeds, so a user is
+# first listed by a visited user at the fewest hops it is from a seed.
+# Users beyond the hop limit or outside the locations asked for are
+# pruned then, for good, and their lists are never fetched. A visited
+# user with fewer than `min_degree' friends and contacts is a dead end:
+# its lists are fetched, but its neighbours are only visited if some
+# other user leads to them. A degree is only known once the lists are
+# fetched, so users are not told apart by it before their visit.
+#
+
+import os, pickle
+
+TARGET_PATH = os.path.normpath('../target.pkl') # pickle
+
+class Target:
+    """Which neighbours of the users visited to visit next."""
+
+    def __init__(self, seeds, hops=None, locations=None, min_degree=1):
+        self.max_hops = hops
+        self.locations = locations and set(locations) or None
+        self.min_degree = min_degree
+        self.hops = dict([(seed, 0) for seed in seeds]) # admitted users
+        self.pruned = set()
+
+    def describe(self):
+        limits = []
+        if self.max_hops is not None:
+            limits.append('%d hops' % self.max_hops)
+        if self.locations:
+            limits.append('in ' + ', '.join(sorted(self.locations)))
+        if self.min_degree > 1:
+            limits.append('expanding users of %d neighbours or more' %
+                          self.min_degree)
+        return ', '.join(limits) or 'no limits'
+
+    def visit(self, uri_id, uid):
+        """Note the uid of a user about to be visited by uri_id."""
+        self.hops[uid] = self.hops.get(uri_id, 0)
+
+    def expand(self, uid, neighbours, location):
+        """The neighbours of visited user uid to visit, in order, none
+        if uid has fewer than min_degree of them.
+
+        location(uid) is the location of a neighbour, looked up only
+        when locations are limited.
+        """
+        if len(neighbours) < self.min_degree:
+            return []
+        hops = self.hops[uid] + 1
+        admitted = []
+        for other in neighbours:
+            if other in self.hops or other in self.pruned:
+                continue
+            if (self.max_hops is not None and hops > self.max_hops) or \
+               (self.locations is not None and
+                location(other) not in self.locations):
+                self.pruned.add(other)
+                continue
+            self.hops[other] = hops
+            admitted.append(other)
+        return admitted
+
+def load(path):
+    """(queue, visited, target) of the targeted crawl saved at path,
+    None if there is none."""
+    if not os.path.exists(path):
+        return None
+    pkl_file = open(path, 'rb')
+    state = pickle.load(pkl_file)
+    pkl_file.close()
+    return state
+
+def save(path, queue, visited, target):
+    pkl_file = open(path + '.tmp', 'wb')
+    pickle.dump((queue, visited, target), pkl_file, pickle.HIGHEST_PROTOCOL)
+    pkl_file.close()
+    os.rename(path + '.tmp', path)
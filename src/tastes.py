@@ -0,0 +1,155 @@
+#
+# Collect the tags users put on their book/movie/music collections
+# author: Wu Zhe <wu@madk.org>
+#
+
+import time, socket, sqlite3, threading, Queue
+import douban, douban.service
+from gdata.service import RequestError
+
+TAG_CATS = ('book', 'movie', 'music')
+MAX_RESULTS = 50
+
+def tags_uri(uid, cat):
+    return '/people/%s/tags?cat=%s' % (uid, cat)
+
+def tag_row(uid, cat, entry):
+    """A `tastes' row from a TagEntry."""
+    return (uid, cat, entry.title.text, int(entry.count.text))
+
+class TastesCrawler(threading.Thread):
+    """Fetches tastes of the users the BFS visits, in the background.
+
+    It has its own API client, paced by `req_interval' independently of
+    the BFS, and its own database connection, writing `batch_size'
+    users per transaction. Responses go to `archive' too if given.
+    """
+
+    Sleep_Timeout = 10
+    Sleep_Banned = 3600 + 5 # douban removes a ban after 1 hour
+    Sleep_Locked = 5 # while the BFS holds the write lock
+
+    def __init__(self, db_path, api_key, req_interval, ttl, batch_size=20,
+                 archive=None):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.db_path = db_path
+        self.client = douban.service.DoubanService(
+            api_key=api_key, min_interval=req_interval)
+        self.ttl = ttl # days before tags are fetched again
+        self.batch_size = batch_size
+        self.archive = archive
+        self.pending = Queue.Queue()
+        self.current = None
+        self.unflushed = [] # fetched, but not in the database yet
+        self.sizes = [] # (uid, number of tags) of unflushed users
+        self.done_count = 0
+
+    def add(self, uid):
+        self.pending.put(uid)
+
+    def stop(self, timeout=30):
+        """Write out the current batch, return the uids left to fetch."""
+        self.pending.put(None)
+        self.join(timeout)
+        # Stuck waiting out a ban or the write lock, or died
+        left = self.unflushed + [self.current]
+        while True:
+            try:
+                left.append(self.pending.get_nowait())
+            except Queue.Empty:
+                break
+        return [uid for uid in left if uid is not None]
+
+    def fetch(self, uid):
+        rows = []
+        for cat in TAG_CATS:
+            converter = douban.TagFeedFromString
+            if self.archive:
+                converter = self._archiving(tags_uri(uid, cat))
+            try:
+                for entry in self.client.IterFeed(tags_uri(uid, cat),
+                                                  converter,
+                                                  max_results=MAX_RESULTS):
+                    rows.append(tag_row(uid, cat, entry))
+            except RequestError, e:
+                if self.archive and e.args and \
+                       isinstance(e.args[0], dict) and \
+                       e.args[0].get('status') == 404:
+                    self.archive.append(tags_uri(uid, cat), 404)
+                raise
+        return rows
+
+    def _archiving(self, uri):
+        """A converter that archives each page of the feed at uri. IterFeed
+        converts the pages in order, which tells their start-index."""
+        pages = [0]
+        def converter(text):
+            start_i = 1 + pages[0] * MAX_RESULTS
+            pages[0] += 1
+            self.archive.append('%s&start-index=%s&max-results=%s' %
+                                (uri, start_i, MAX_RESULTS), 200, text)
+            return douban.TagFeedFromString(text)
+        return converter
+
+    def run(self):
+        conn = sqlite3.connect(self.db_path, timeout=60)
+        cursor = conn.cursor()
+        rows = []
+        while True:
+            uid = self.pending.get()
+            if uid is None: break
+            if self._fetched(cursor, uid):
+                continue
+            self.current = uid
+            try:
+                size_before = len(rows)
+                rows.extend(self.fetch(uid))
+            except RequestError, e:
+                if e.args and isinstance(e.args[0], dict) and \
+                       e.args[0].get('status') == 404:
+                    # The user is gone, remember there is nothing to fetch
+                    self.unflushed.append(uid)
+                    self.sizes.append((uid, 0))
+                else:
+                    time.sleep(self.Sleep_Banned)
+                    self.add(uid)
+            except socket.error:
+                time.sleep(self.Sleep_Timeout)
+                self.add(uid)
+            else:
+                self.unflushed.append(uid)
+                self.done_count += 1
+                self.sizes.append((uid, len(rows) - size_before))
+            self.current = None
+            if len(self.unflushed) >= self.batch_size:
+                self._flush(conn, rows)
+                rows = []
+        self._flush(conn, rows)
+        conn.close()
+
+    def _fetched(self, cursor, uid):
+        """Were uid's tags fetched within the last `ttl' days?"""
+        cursor.execute("SELECT 1 FROM fetches WHERE uid=? AND list='tags' " +
+                       "AND (fetched IS NULL OR fetched > DATETIME('NOW', ?))",
+                       (uid, '-%d days' % self.ttl))
+        return cursor.fetchone() is not None
+
+    def _flush(self, conn, rows):
+        if self.archive:
+            self.archive.flush()
+        while True:
+            try:
+                conn.executemany("INSERT OR REPLACE INTO tastes VALUES " +
+                                 "(?,?,?,?)", rows)
+                conn.executemany("INSERT OR REPLACE INTO fetches VALUES " +
+                                 "(?,'tags',DATETIME('NOW'),?)", self.sizes)
+                conn.commit()
+                break
+            except sqlite3.OperationalError:
+                # Locked for longer than the timeout, by the BFS paging
+                # through a long list
+                conn.rollback()
+                time.sleep(self.Sleep_Locked)
+        self.unflushed = []
+        self.sizes = []